@@ -1,23 +1,25 @@
 import os
 import logging
 import time
-import signal
-from functools import wraps
-from collections import defaultdict
+from functools import partial
 
-import pandas as pd
 import numpy as np
+from scipy.sparse import csr_matrix
 from flask import Flask, jsonify, request
 from flask_cors import CORS
-from sklearn.cluster import KMeans
-from sklearn.preprocessing import StandardScaler
-from sklearn.decomposition import TruncatedSVD
-from sklearn.metrics import silhouette_score
 import psutil
 from dotenv import load_dotenv
 
 from scrap import scrap, verify_letterboxd_user
-from data_manager import DataManager
+from data_manager import create_data_manager
+from cache import VersionedLRUCache
+from jobs import JobCancelled, JobManager
+from deadline import Deadline, DeadlineExceeded, check_deadline
+from rate_limiter import RateLimiter
+from recommender import (
+    Recommender, ALSModel, ItemNeighbors, TopN, UserNeighborIndex,
+    build_als, build_item_neighbors, film_scores, top_k, top_k_rows
+)
 
 # Setup logging
 logging.basicConfig(level=logging.DEBUG)
@@ -26,8 +28,22 @@ logger = logging.getLogger(__name__)
 # Load env vars
 load_dotenv()
 
-# Initialize data manager (uses JSON files instead of PostgreSQL)
-data_manager = DataManager()
+# Initialize data manager (JSON files by default, SQLite with DATA_BACKEND=sqlite)
+data_manager = create_data_manager()
+
+# Models fitted once per data version and shared through data/models (data/models_sqlite no SQLite)
+MODEL_DIR = data_manager.model_dir
+recommender = Recommender(MODEL_DIR)
+item_recommender = Recommender(MODEL_DIR, "item", build_item_neighbors, ItemNeighbors)
+als_recommender = Recommender(MODEL_DIR, "als", build_als, ALSModel)
+user_index = UserNeighborIndex()
+
+# Engines selecionáveis por requisição (?engine=...)
+ENGINES = ("cluster", "item", "user", "als")
+MODELOS_POR_ENGINE = {"cluster": recommender, "user": recommender, "item": item_recommender, "als": als_recommender}
+
+# Engines cujo top-10 de todos os usuários é pré-calculado após cada treino
+PRECOMPUTE_ENGINES = [e for e in os.getenv('PRECOMPUTE_ENGINES', 'cluster').split(',') if e in ENGINES]
 
 # Flask app setup
 app = Flask(__name__)
@@ -36,31 +52,30 @@ CORS(app)
 # Rate limiting config
 RATE_LIMIT_WINDOW = 60  # seconds
 RATE_LIMIT_MAX_REQUESTS = 10
-request_counts = defaultdict(list)
-
-# Cache config
-user_cache = {}
-CACHE_EXPIRY = 300  # seconds cache expiry
-
-# Timeout decorator for Railway-friendly execution
+# Token bucket por rota e IP: (requisições, janela em segundos); rotas fora daqui não são limitadas.
+# Os buckets ficam na memória de cada worker do gunicorn, então o limite efetivo por IP
+# chega a N vezes estes valores com N workers (WEB_CONCURRENCY); ajuste-os ao escalar
+RATE_LIMITS = {
+    "recomendacoes": (RATE_LIMIT_MAX_REQUESTS, RATE_LIMIT_WINDOW),
+    "batch": (3, RATE_LIMIT_WINDOW),
+    "jobs": (120, RATE_LIMIT_WINDOW),
+    "populate": (2, 300),
+}
+rate_limiter = RateLimiter(RATE_LIMITS)
+
+# Cache config: dados derivados da versão atual, compartilhados por todos os usuários
+CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_MB', 256)) * 1024 * 1024
+data_cache = VersionedLRUCache(CACHE_MAX_BYTES)
+
+# Jobs em segundo plano (scraping de usuários novos), visíveis para todos os workers
+job_manager = JobManager(os.path.join(data_manager.data_dir, "jobs"))
+
+# Prazo por requisição (cooperativo: verificado entre as etapas, funciona em qualquer worker)
 REQUEST_TIMEOUT = 20  # seconds
 
-def timeout_handler(signum, frame):
-    raise TimeoutError("Operation timed out")
-
-def timeout_decorator(seconds):
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            old_handler = signal.signal(signal.SIGALRM, timeout_handler)
-            signal.alarm(seconds)
-            try:
-                return func(*args, **kwargs)
-            finally:
-                signal.alarm(0)
-                signal.signal(signal.SIGALRM, old_handler)
-        return wrapper
-    return decorator
+# Batch endpoint: max usernames per request and users scored per vectorized block
+BATCH_MAX_USERS = int(os.getenv('BATCH_MAX_USERS', 100))
+BATCH_BLOCK_SIZE = 32
 
 def get_db_connection():
     """Legacy function - now uses DataManager"""
@@ -90,26 +105,137 @@ def adicionar_usuario(usuario):
         logger.error(f"Erro ao adicionar usuário {usuario}: {str(e)}")
         return False
 
-@timeout_decorator(REQUEST_TIMEOUT)
-def gerar_recomendacoes(usuario_alvo):
-    logger.info(f"Iniciando geração de recomendações para usuário: {usuario_alvo}")
+def executar_scrape(job):
+    """Job: verifica o usuário no Letterboxd e importa suas avaliações"""
+    usuario = job.params['usuario']
+    if not adicionar_usuario(usuario):
+        raise ValueError(f"Usuário {usuario} não encontrado no Letterboxd")
+    return {"usuario": usuario, "recomendacoes_url": f"/api/recomendacoes/{usuario}"}
+
+def executar_populate(job):
+    """Job: popula a base com os perfis semente, salvando o progresso por usuário"""
+    from populate_data import SEED_USERS, populate_initial_data
+    usuarios = job.params.get('usuarios') or SEED_USERS
+    # Ao retomar após um restart, os usuários já processados são pulados
+    processados = dict(job.progress.get('usuarios', {}))
+    erros = list(job.progress.get('erros', []))
+
+    def registrar(usuario, resultado, resumo):
+        processados[usuario] = resultado
+        erros.extend(e for e in resumo['errors'] if e['user'] == usuario)
+        job.update(progress={
+            "total": len(usuarios),
+            "processados": len(processados),
+            "atual": usuario,
+            "usuarios": processados,
+            "erros": erros
+        })
+
+    populate_initial_data(usuarios, data_manager, skip=processados, on_user=registrar,
+                          should_stop=job.cancelled)
+    if job.cancelled():
+        raise JobCancelled()
+    resultados = list(processados.values())
+    return {
+        "attempted": len(processados),
+        "successful": resultados.count("successful"),
+        "skipped": resultados.count("skipped"),
+        "errors": erros
+    }
+
+job_manager.register("scrape_user", executar_scrape)
+job_manager.register("populate", executar_populate)
+
+@app.before_request
+def iniciar_jobs():
+    # As threads dos jobs são de cada worker: nada roda no master do gunicorn (preload_app),
+    # e cada processo retoma os jobs interrompidos de onde pararam no primeiro request
+    job_manager.start()
+
+def resposta_pendente(usuario, job):
+    return {
+        "status": "pending",
+        "message": f"Importando {usuario} do Letterboxd; consulte o job e tente novamente quando concluir",
+        "job_id": job['id'],
+        "job_url": f"/api/jobs/{job['id']}",
+        "recomendacoes": {},
+        "metadata": {}
+    }
+
+def usuarios_referencia(model, engine, usuario_alvo, codigo_usuario, filmes, notas):
+    """Códigos dos usuários cujas avaliações pontuam os filmes: cluster do usuário ou vizinhos mais próximos"""
+    linha_usuario = model.user_row(codigo_usuario)
+    tem_avaliacoes = len(filmes) > 0
+    if engine == "user" and (linha_usuario is not None or tem_avaliacoes):
+        # Usuários mais próximos no espaço do SVD (usuário novo é projetado)
+        if linha_usuario is not None:
+            embedding = model.embeddings[linha_usuario]
+        else:
+            embedding = model.project(filmes, notas)
+        usuarios_cluster = user_index.query(model, embedding, exclude=codigo_usuario)
+        logger.info(f"Usuário {usuario_alvo}: {len(usuarios_cluster)} vizinhos mais próximos")
+    elif linha_usuario is not None:
+        cluster_usuario = model.labels[linha_usuario]
+        logger.info(f"Usuário {usuario_alvo} está no cluster {cluster_usuario}")
+        usuarios_cluster = model.cluster_members(cluster_usuario)
+    elif tem_avaliacoes:
+        # Usuário novo: projetar no espaço do modelo atual em vez de retreinar
+        cluster_usuario = model.fold_in(filmes, notas)
+        logger.info(f"Usuário {usuario_alvo} projetado no cluster {cluster_usuario}")
+        usuarios_cluster = model.cluster_members(cluster_usuario)
+    else:
+        logger.info(f"Usuário {usuario_alvo} não tem avaliações, usando todos os usuários")
+        usuarios_cluster = model.user_codes
+    if len(usuarios_cluster) < 2:
+        logger.info("Poucos usuários no cluster, usando todos")
+        usuarios_cluster = model.user_codes
+    return usuarios_cluster
+
+def dados_preparados(columns):
+    """
+    (user_idx, movie_idx, notas em float64, scores globais, filmes com avaliações),
+    calculados uma vez por versão dos dados
+    """
+    def preparar():
+        movie_idx = np.asarray(columns.movie_idx)
+        ratings = np.asarray(columns.rating, dtype=np.float64)
+        # Todos os filmes com avaliações (o modelo pode ser de uma versão anterior)
+        scores_globais, contagem_global = film_scores(movie_idx, ratings, len(columns.titles))
+        return np.asarray(columns.user_idx), movie_idx, ratings, scores_globais, np.flatnonzero(contagem_global)
+    return data_cache.get_or_compute(columns.version, "dados", preparar)
+
+def matrizes_avaliacoes(columns):
+    """Matriz esparsa usuários x filmes com as notas, e outra só com a presença da avaliação"""
+    def montar():
+        user_idx, movie_idx, ratings, _, _ = dados_preparados(columns)
+        shape = (len(columns.usernames), len(columns.titles))
+        notas = csr_matrix((ratings, (user_idx, movie_idx)), shape=shape)
+        presenca = csr_matrix((np.ones(len(ratings)), (user_idx, movie_idx)), shape=shape)
+        return notas, presenca
+    return data_cache.get_or_compute(columns.version, "matrizes", montar)
+
+def completar_com_populares(recomendacoes, recomendados, todos_filmes, scores_globais):
+    """Completa até 10 recomendações com os filmes mais bem avaliados da base"""
+    if len(recomendacoes) < 10:
+        filmes_potenciais = np.setdiff1d(todos_filmes, recomendados)
+        populares = top_k(filmes_potenciais, scores_globais[filmes_potenciais], 10 - len(recomendacoes))
+        recomendacoes.extend({'filme': int(f), 'score': float(scores_globais[f])} for f in populares)
+    return recomendacoes[:10]
+
+def recomendacoes_populares():
+    """Filmes mais bem avaliados da base (agregados mantidos pelo DataManager, sem modelo)"""
+    return {titulo: float(score) for titulo, score in data_manager.get_popular_movies(limit=10)}
+
+def gerar_recomendacoes(usuario_alvo, engine="cluster", deadline=None):
+    logger.info(f"Iniciando geração de recomendações para usuário: {usuario_alvo} (engine {engine})")
     start_time = time.time()
+    deadline = deadline or Deadline(REQUEST_TIMEOUT)
     try:
-        # Check cache first
-        current_time = time.time()
-        if usuario_alvo in user_cache and (current_time - user_cache[usuario_alvo]['timestamp']) < CACHE_EXPIRY:
-            logger.debug(f"Usando dados em cache para usuário {usuario_alvo}")
-            df = user_cache[usuario_alvo]['data']
-        else:
-            logger.debug("Buscando avaliações no DataManager")
-            all_ratings = data_manager.get_all_ratings()
-            
-            # Convert to DataFrame
-            df = pd.DataFrame(all_ratings, columns=['username', 'title', 'rating'])
-            user_cache[usuario_alvo] = {'data': df, 'timestamp': time.time()}
-            logger.debug("Cache atualizado")
-
-        if df.empty or len(df) < 2:
+        # Colunas da versão atual (o DataManager só as recarrega quando os dados mudam)
+        logger.debug("Buscando avaliações no DataManager")
+        columns = data_manager.get_ratings_columns()
+
+        if len(columns.rating) < 2:
             logger.warning("Dados insuficientes para recomendações")
             return {
                 "error": "Dados insuficientes para gerar recomendações",
@@ -119,97 +245,83 @@ def gerar_recomendacoes(usuario_alvo):
                 "metadata": {}
             }
 
-        # Garantir que usuário está no sistema
+        # Garantir que usuário está no sistema: o scraping roda em segundo plano
         if not data_manager.user_exists(usuario_alvo):
-            logger.info(f"Usuário {usuario_alvo} não encontrado. Tentando adicionar...")
-            if adicionar_usuario(usuario_alvo):
-                logger.info("Usuário adicionado com sucesso. Gerando recomendações...")
-                return gerar_recomendacoes(usuario_alvo)
-            else:
-                logger.warning(f"Falha ao adicionar usuário {usuario_alvo}")
-                return {
-                    "error": f"Usuário {usuario_alvo} não encontrado no Letterboxd",
-                    "status": "user_not_found",
-                    "message": "Verifique o nome do usuário.",
-                    "recomendacoes": {}
-                }
-
-        # Criar matriz usuário-filme
-        logger.debug("Criando matriz usuário-filme")
-        rating_matrix = df.pivot_table(index='username', columns='title', values='rating', fill_value=0)
-
-        filmes_usuario = set(df[df['username'] == usuario_alvo]['title'])
-        todos_filmes = set(df['title'])
-        filmes_nao_vistos = todos_filmes - filmes_usuario
-
+            logger.info(f"Usuário {usuario_alvo} não encontrado. Enfileirando scraping...")
+            job = job_manager.submit("scrape_user", {"usuario": usuario_alvo}, key=usuario_alvo)
+            return resposta_pendente(usuario_alvo, job)
+        job = job_manager.find_active("scrape_user", usuario_alvo)
+        if job is not None:
+            # Usuário já criado, mas as avaliações ainda estão sendo importadas
+            return resposta_pendente(usuario_alvo, job)
+
+        # Daqui em diante tudo é feito sobre códigos inteiros; títulos só no top-10
+        codigo_usuario = columns.usernames.encode(usuario_alvo)
+        if codigo_usuario is None:
+            # Usuário incluído por outro worker depois da leitura das colunas
+            columns = data_manager.get_ratings_columns()
+            codigo_usuario = columns.usernames.encode(usuario_alvo)
+
+        # Pré-calculado no último treino; só usuários incluídos depois são calculados ao vivo
+        resposta = servir_pre_calculado(columns, usuario_alvo, codigo_usuario, engine, start_time)
+        if resposta is not None:
+            return resposta
+
+        deadline.check("preparação dos dados")
+        user_idx, movie_idx, ratings, scores_globais, todos_filmes = dados_preparados(columns)
+
+        linhas_usuario = columns.user_rows(codigo_usuario)
+        filmes_usuario = np.unique(movie_idx[linhas_usuario])
+        n_filmes = len(columns.titles)
+
+        filmes_nao_vistos = np.setdiff1d(todos_filmes, filmes_usuario, assume_unique=True)
         logger.debug(f"Filmes não vistos pelo usuário: {len(filmes_nao_vistos)}")
 
-        # Pré-processamento e redução de dimensionalidade
-        scaler = StandardScaler()
-        X_scaled = scaler.fit_transform(rating_matrix)
-
-        n_components = min(30, X_scaled.shape[1] - 1)
-        if n_components > 0:
-            svd = TruncatedSVD(n_components=n_components, random_state=42)
-            X_reduced = svd.fit_transform(X_scaled)
+        if engine == "item":
+            # Vizinhos pré-calculados: soma das similaridades ponderada pelas notas do usuário
+            model = item_recommender.get_model(columns, deadline)
+            deadline.check("pontuação")
+            recomendados, scores_item = model.recommend(
+                movie_idx[linhas_usuario], ratings[linhas_usuario], 10
+            )
+            recomendacoes = [{'filme': int(f), 'score': float(s)} for f, s in zip(recomendados, scores_item)]
+            total_usuarios = len(columns.usernames)
+        elif engine == "als":
+            # Fatores latentes: um produto escalar contra todos os filmes
+            model = als_recommender.get_model(columns, deadline)
+            deadline.check("pontuação")
+            recomendados, scores_als = model.recommend(
+                codigo_usuario, movie_idx[linhas_usuario], ratings[linhas_usuario], 10
+            )
+            recomendacoes = [{'filme': int(f), 'score': float(s)} for f, s in zip(recomendados, scores_als)]
+            total_usuarios = len(model.user_codes)
         else:
-            X_reduced = X_scaled
-
-        # Definir clusters automaticamente com KMeans e silhouette score
-        best_score = -1
-        best_k = 2
-        max_clusters = min(10, len(rating_matrix))
-        for k in range(2, max_clusters + 1):
-            km = KMeans(n_clusters=k, random_state=42, n_init=10)
-            labels = km.fit_predict(X_reduced)
-            score = silhouette_score(X_reduced, labels) if len(set(labels)) > 1 else -1
-            if score > best_score:
-                best_score = score
-                best_k = k
-
-        logger.info(f"Melhor número de clusters: {best_k}")
-
-        kmeans = KMeans(n_clusters=best_k, random_state=42, n_init=20)
-        clusters = kmeans.fit_predict(X_reduced)
-        rating_matrix['cluster'] = clusters
-
-        cluster_usuario = rating_matrix.loc[usuario_alvo, 'cluster']
-        logger.info(f"Usuário {usuario_alvo} está no cluster {cluster_usuario}")
-
-        usuarios_cluster = rating_matrix[rating_matrix['cluster'] == cluster_usuario].index.tolist()
-        if len(usuarios_cluster) < 2:
-            logger.info("Poucos usuários no cluster, usando todos")
-            usuarios_cluster = rating_matrix.index.tolist()
-
-        # Calcular score para os filmes não vistos
-        recomendacoes = []
-        for filme in filmes_nao_vistos:
-            if filme in rating_matrix.columns:
-                avaliacoes = df[(df['title'] == filme) & (df['username'].isin(usuarios_cluster))]['rating']
-                if len(avaliacoes) == 0:
-                    continue
-                media = avaliacoes.mean()
-                count = len(avaliacoes)
-                score = media * (1 + 0.1 * count)
-                recomendacoes.append({'filme': filme, 'score': float(score)})
+            # Modelo pré-treinado para esta versão dos dados
+            model = recommender.get_model(columns, deadline)
+            deadline.check("pontuação")
+
+            usuarios_cluster = usuarios_referencia(
+                model, engine, usuario_alvo, codigo_usuario, movie_idx[linhas_usuario], ratings[linhas_usuario]
+            )
+
+            # Máscara por avaliação: o autor da avaliação está no cluster (ou entre os vizinhos)?
+            no_cluster = np.zeros(len(columns.usernames), dtype=bool)
+            no_cluster[usuarios_cluster] = True
+            avaliacao_no_cluster = no_cluster[user_idx]
+
+            # Calcular média e contagem de todos os filmes no cluster de uma só vez
+            scores_cluster, contagem_cluster = film_scores(movie_idx, ratings, n_filmes, avaliacao_no_cluster)
+            candidatos = filmes_nao_vistos[contagem_cluster[filmes_nao_vistos] > 0]
+            recomendados = top_k(candidatos, scores_cluster[candidatos], 10)
+            recomendacoes = [{'filme': int(f), 'score': float(scores_cluster[f])} for f in recomendados]
+            total_usuarios = len(model.user_codes)
 
         # Completar com filmes populares se necessário
-        recomendacoes.sort(key=lambda x: x['score'], reverse=True)
-        if len(recomendacoes) < 10:
-            filmes_potenciais = [f for f in todos_filmes if f not in [r['filme'] for r in recomendacoes]]
-            populares = []
-            for filme in filmes_potenciais:
-                avaliacoes = df[df['title'] == filme]['rating']
-                if len(avaliacoes) == 0:
-                    continue
-                media = avaliacoes.mean()
-                count = len(avaliacoes)
-                populares.append({'filme': filme, 'score': media * (1 + 0.1 * count)})
-            populares.sort(key=lambda x: x['score'], reverse=True)
-            recomendacoes.extend(populares[:10 - len(recomendacoes)])
-
-        # Preparar resposta
-        top_recomendacoes = {r['filme']: r['score'] for r in recomendacoes[:10]}
+        top = completar_com_populares(recomendacoes, recomendados, todos_filmes, scores_globais)
+
+        # Preparar resposta (decodifica os títulos apenas do top-10)
+        titulos = columns.titles.decode_many(r['filme'] for r in top)
+        top_recomendacoes = {titulo: r['score'] for titulo, r in zip(titulos, top)}
 
         processing_time = time.time() - start_time
         logger.info(f"Recomendações geradas para {usuario_alvo} em {processing_time:.2f}s")
@@ -219,7 +331,8 @@ def gerar_recomendacoes(usuario_alvo):
             "message": "Recomendações geradas com sucesso",
             "recomendacoes": top_recomendacoes,
             "metadata": {
-                "total_usuarios": len(rating_matrix),
+                "engine": engine,
+                "total_usuarios": total_usuarios,
                 "total_filmes": len(todos_filmes),
                 "filmes_nao_vistos": len(filmes_nao_vistos),
                 "total_recomendacoes": len(top_recomendacoes),
@@ -227,13 +340,19 @@ def gerar_recomendacoes(usuario_alvo):
             }
         }
 
-    except TimeoutError:
-        logger.error("Timeout ao gerar recomendações")
+    except DeadlineExceeded as e:
+        # Melhor resultado parcial: filmes populares (o modelo continua treinando em segundo plano)
+        logger.error(f"Timeout ao gerar recomendações: {str(e)}")
         return {
-            "status": "timeout",
-            "message": "Tempo excedido para gerar recomendações",
-            "recomendacoes": {},
-            "metadata": {}
+            "status": "partial",
+            "message": "Tempo excedido; retornando filmes populares",
+            "recomendacoes": recomendacoes_populares(),
+            "metadata": {
+                "engine": engine,
+                "fallback": "populares",
+                "motivo": str(e),
+                "processing_time": time.time() - start_time
+            }
         }
     except Exception as e:
         logger.error(f"Erro ao gerar recomendações: {str(e)}")
@@ -245,29 +364,319 @@ def gerar_recomendacoes(usuario_alvo):
         }
 
 
+def pontuar_lote(columns, conhecidos, engine, deadline=None):
+    """
+    Top-10 (já completado com populares) de cada (usuário, código, linhas) em conhecidos,
+    avaliando o modelo uma vez. Retorna ({usuário: [{'filme', 'score'}]}, total de usuários, total de filmes).
+    """
+    user_idx, movie_idx, ratings, scores_globais, todos_filmes = dados_preparados(columns)
+    n_usuarios = len(columns.usernames)
+
+    recomendacoes_por_usuario = {}
+    if engine == "item":
+        model = item_recommender.get_model(columns, deadline)
+        total_usuarios = n_usuarios
+        for usuario, codigo, linhas in conhecidos:
+            recomendados, scores = model.recommend(movie_idx[linhas], ratings[linhas], 10)
+            recomendacoes_por_usuario[usuario] = (recomendados, scores)
+    elif engine == "als":
+        model = als_recommender.get_model(columns, deadline)
+        total_usuarios = len(model.user_codes)
+        # Um produto de matrizes por bloco de usuários (fatores x filmes)
+        for inicio in range(0, len(conhecidos), BATCH_BLOCK_SIZE):
+            check_deadline(deadline, "pontuação em lote")
+            bloco = conhecidos[inicio:inicio + BATCH_BLOCK_SIZE]
+            resultados = model.recommend_many(
+                [(codigo, movie_idx[linhas], ratings[linhas]) for _, codigo, linhas in bloco], 10
+            )
+            for (usuario, _, _), resultado in zip(bloco, resultados):
+                recomendacoes_por_usuario[usuario] = resultado
+    elif conhecidos:
+        model = recommender.get_model(columns, deadline)
+        total_usuarios = len(model.user_codes)
+
+        notas, presenca = matrizes_avaliacoes(columns)
+
+        for inicio in range(0, len(conhecidos), BATCH_BLOCK_SIZE):
+            check_deadline(deadline, "pontuação em lote")
+            bloco = conhecidos[inicio:inicio + BATCH_BLOCK_SIZE]
+
+            # Pertinência (usuário do lote x usuário de referência): soma e contagem por filme num só produto
+            linhas_pertinencia, colunas_pertinencia = [], []
+            for i, (usuario, codigo, linhas) in enumerate(bloco):
+                referencia = usuarios_referencia(
+                    model, engine, usuario, codigo, movie_idx[linhas], ratings[linhas]
+                )
+                linhas_pertinencia.append(np.full(len(referencia), i))
+                colunas_pertinencia.append(referencia)
+            colunas_pertinencia = np.concatenate(colunas_pertinencia)
+            pertinencia = csr_matrix(
+                (np.ones(len(colunas_pertinencia)), (np.concatenate(linhas_pertinencia), colunas_pertinencia)),
+                shape=(len(bloco), n_usuarios)
+            )
+            somas = (pertinencia @ notas).toarray()
+            contagens = (pertinencia @ presenca).toarray()
+
+            scores = np.full(somas.shape, -np.inf)
+            avaliados = contagens > 0
+            scores[avaliados] = somas[avaliados] / contagens[avaliados] * (1 + 0.1 * contagens[avaliados])
+            for i, (usuario, codigo, linhas) in enumerate(bloco):
+                scores[i, movie_idx[linhas]] = -np.inf
+
+            for i, colunas in enumerate(top_k_rows(scores, 10)):
+                validos = colunas[np.isfinite(scores[i, colunas])]
+                recomendacoes_por_usuario[bloco[i][0]] = (validos, scores[i, validos])
+    else:
+        total_usuarios = n_usuarios
+
+    tops = {}
+    for usuario, (recomendados, scores) in recomendacoes_por_usuario.items():
+        recomendacoes = [{'filme': int(f), 'score': float(s)} for f, s in zip(recomendados, scores)]
+        tops[usuario] = completar_com_populares(recomendacoes, recomendados, todos_filmes, scores_globais)
+    return tops, total_usuarios, len(todos_filmes)
+
+
+def precomputar_top_n(engine, columns, deadline=None):
+    """Top-10 de todos os usuários da versão dos dados, indexado pelo código do usuário"""
+    logger.info(f"Pré-calculando recomendações ({engine}) para a versão {columns.version}")
+    n_usuarios = len(columns.usernames)
+    # Usuários ainda sem avaliações ficam de fora (linha -1): quando as notas
+    # chegarem, são calculados na hora em vez de receber os populares pré-calculados
+    avaliacoes_por_usuario = np.diff(columns.user_indptr)
+    conhecidos = [
+        (codigo, codigo, columns.user_rows(codigo))
+        for codigo in np.flatnonzero(avaliacoes_por_usuario).tolist()
+    ]
+    tops, _, _ = pontuar_lote(columns, conhecidos, engine, deadline)
+
+    filmes = np.full((n_usuarios, 10), -1, dtype=np.int32)
+    scores = np.zeros((n_usuarios, 10), dtype=np.float32)
+    for codigo, top in tops.items():
+        filmes[codigo, :len(top)] = [r['filme'] for r in top]
+        scores[codigo, :len(top)] = [r['score'] for r in top]
+    return TopN(version=columns.version, movies=filmes, scores=scores)
+
+# Resultados pré-calculados, refeitos sempre que o modelo da engine é treinado
+top_n_stores = {
+    engine: Recommender(MODEL_DIR, f"topn_{engine}", partial(precomputar_top_n, engine), TopN)
+    for engine in PRECOMPUTE_ENGINES
+}
+for engine, store in top_n_stores.items():
+    # Pelo mesmo caminho do retreino: um pré-cálculo por vez, entre threads e processos
+    MODELOS_POR_ENGINE[engine].on_build.append(store._schedule_rebuild)
+
+def servir_pre_calculado(columns, usuario_alvo, codigo_usuario, engine, start_time):
+    """Resposta a partir do último pré-cálculo, ou None se o usuário entrou depois dele"""
+    store = top_n_stores.get(engine)
+    if store is None:
+        return None
+    top_n = store.get_saved(columns.version)
+    model = MODELOS_POR_ENGINE[engine].get_saved(columns.version)
+    if model is not None and (top_n is None or top_n.version < model.version):
+        # O pré-cálculo do modelo atual falhou, o worker foi reciclado no meio ou nunca rodou
+        store._schedule_rebuild(columns)
+    resultado = top_n.lookup(codigo_usuario) if top_n is not None else None
+    if resultado is None:
+        return None
+    if top_n.version < columns.version:
+        # Dados mudaram desde o treino: agenda o retreino (que refaz o pré-cálculo)
+        MODELOS_POR_ENGINE[engine].get_model(columns)
+
+    filmes, scores = resultado
+    titulos = columns.titles.decode_many(int(f) for f in filmes)
+    top_recomendacoes = {titulo: float(score) for titulo, score in zip(titulos, scores)}
+
+    processing_time = time.time() - start_time
+    logger.info(f"Recomendações pré-calculadas (v{top_n.version}) servidas para {usuario_alvo}")
+    return {
+        "status": "success",
+        "message": "Recomendações geradas com sucesso",
+        "recomendacoes": top_recomendacoes,
+        "metadata": {
+            "engine": engine,
+            "pre_calculado": True,
+            "versao_dados": top_n.version,
+            "total_recomendacoes": len(top_recomendacoes),
+            "processing_time": processing_time
+        }
+    }
+
+def gerar_recomendacoes_batch(usuarios, engine="cluster", deadline=None):
+    """
+    Recomendações para vários usuários com uma única avaliação do modelo. Usuários
+    fora da base recebem status próprio (o scraping fica com a rota individual).
+    """
+    logger.info(f"Gerando recomendações em lote para {len(usuarios)} usuários (engine {engine})")
+    start_time = time.time()
+    deadline = deadline or Deadline(REQUEST_TIMEOUT)
+    resultados = {}
+    try:
+        columns = data_manager.get_ratings_columns()
+        if len(columns.rating) < 2:
+            logger.warning("Dados insuficientes para recomendações")
+            return {
+                "status": "insufficient_data",
+                "message": "É necessário pelo menos 2 usuários com avaliações",
+                "resultados": {},
+                "metadata": {}
+            }
+
+        conhecidos = []
+        for usuario in usuarios:
+            codigo = columns.usernames.encode(usuario)
+            if codigo is None:
+                resultados[usuario] = {
+                    "status": "user_not_found",
+                    "message": "Usuário não está na base; use /api/recomendacoes/<usuario> para adicioná-lo",
+                    "recomendacoes": {}
+                }
+            else:
+                conhecidos.append((usuario, codigo, columns.user_rows(codigo)))
+
+        # Modelo avaliado uma única vez para o lote inteiro
+        tops, total_usuarios, total_filmes = pontuar_lote(columns, conhecidos, engine, deadline)
+        for usuario, top in tops.items():
+            titulos = columns.titles.decode_many(r['filme'] for r in top)
+            resultados[usuario] = {
+                "status": "success",
+                "recomendacoes": {titulo: r['score'] for titulo, r in zip(titulos, top)}
+            }
+
+        processing_time = time.time() - start_time
+        logger.info(f"Lote de {len(usuarios)} usuários processado em {processing_time:.2f}s")
+
+        return {
+            "status": "success",
+            "message": "Recomendações geradas com sucesso",
+            "resultados": resultados,
+            "metadata": {
+                "engine": engine,
+                "total_usuarios": total_usuarios,
+                "total_filmes": total_filmes,
+                "usuarios_processados": len(tops),
+                "processing_time": processing_time
+            }
+        }
+
+    except DeadlineExceeded as e:
+        # Melhor resultado parcial: filmes populares para quem não é usuário desconhecido
+        logger.error(f"Timeout ao gerar recomendações em lote: {str(e)}")
+        populares = recomendacoes_populares()
+        for usuario in usuarios:
+            resultados.setdefault(usuario, {"status": "partial", "recomendacoes": populares})
+        return {
+            "status": "partial",
+            "message": "Tempo excedido; retornando filmes populares",
+            "resultados": resultados,
+            "metadata": {
+                "engine": engine,
+                "fallback": "populares",
+                "motivo": str(e),
+                "processing_time": time.time() - start_time
+            }
+        }
+    except Exception as e:
+        logger.error(f"Erro ao gerar recomendações em lote: {str(e)}")
+        return {
+            "status": "error",
+            "message": str(e),
+            "resultados": {},
+            "metadata": {}
+        }
+
+
+def rate_limit_excedido(rota):
+    """Consome um token do IP atual na rota e diz se o balde estava vazio"""
+    client_ip = request.remote_addr or 'unknown'
+    if rate_limiter.allow(rota, client_ip):
+        return False
+    logger.warning(f"Rate limit excedido para IP {client_ip} na rota {rota}")
+    return True
+
+def resposta_rate_limited():
+    return jsonify({
+        "status": "rate_limited",
+        "message": "Muitas requisições, tente novamente mais tarde"
+    }), 429
+
+
 @app.route('/api/recomendacoes/<usuario>')
 def api_recomendacoes(usuario):
     logger.info(f"Requisição recebida para recomendações do usuário: {usuario}")
-    current_time = time.time()
-    client_ip = request.remote_addr or 'unknown'
+    deadline = Deadline(REQUEST_TIMEOUT)
 
     # Rate limiting
-    request_counts[client_ip] = [t for t in request_counts[client_ip] if current_time - t < RATE_LIMIT_WINDOW]
-    if len(request_counts[client_ip]) >= RATE_LIMIT_MAX_REQUESTS:
-        logger.warning(f"Rate limit excedido para IP {client_ip}")
+    if rate_limit_excedido("recomendacoes"):
         return jsonify({
             "status": "rate_limited",
             "message": "Muitas requisições, tente novamente mais tarde",
             "recomendacoes": {},
             "metadata": {}
         }), 429
-    request_counts[client_ip].append(current_time)
 
-    recomendacoes = gerar_recomendacoes(usuario)
+    engine = request.args.get('engine', 'cluster')
+    if engine not in ENGINES:
+        return jsonify({
+            "status": "error",
+            "message": f"Engine inválida: {engine}. Opções: {', '.join(ENGINES)}",
+            "recomendacoes": {},
+            "metadata": {}
+        }), 400
+
+    recomendacoes = gerar_recomendacoes(usuario, engine, deadline)
     logger.debug(f"Recomendações enviadas para {usuario}: {recomendacoes}")
+    if recomendacoes.get("status") == "pending":
+        return jsonify(recomendacoes), 202
     return jsonify(recomendacoes)
 
 
+@app.route('/api/jobs/<job_id>')
+def api_job(job_id):
+    if rate_limit_excedido("jobs"):
+        return resposta_rate_limited()
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"status": "not_found", "message": f"Job {job_id} não encontrado"}), 404
+    return jsonify(job)
+
+
+@app.route('/api/recomendacoes/batch', methods=['POST'])
+def api_recomendacoes_batch():
+    """Body: {"usuarios": [...], "engine": "cluster"}; conta como uma única requisição no rate limit"""
+    deadline = Deadline(REQUEST_TIMEOUT)
+    if rate_limit_excedido("batch"):
+        return jsonify({
+            "status": "rate_limited",
+            "message": "Muitas requisições, tente novamente mais tarde",
+            "resultados": {},
+            "metadata": {}
+        }), 429
+
+    payload = request.get_json(silent=True) or {}
+    usuarios = payload.get('usuarios')
+    engine = payload.get('engine', request.args.get('engine', 'cluster'))
+    if not isinstance(usuarios, list) or not all(isinstance(u, str) for u in usuarios):
+        erro = "Envie {\"usuarios\": [\"nome1\", \"nome2\", ...]}"
+    elif len(usuarios) > BATCH_MAX_USERS:
+        erro = f"Máximo de {BATCH_MAX_USERS} usuários por lote"
+    elif engine not in ENGINES:
+        erro = f"Engine inválida: {engine}. Opções: {', '.join(ENGINES)}"
+    else:
+        erro = None
+    if erro:
+        return jsonify({
+            "status": "error",
+            "message": erro,
+            "resultados": {},
+            "metadata": {}
+        }), 400
+
+    # Nomes repetidos são processados uma vez só
+    resultado = gerar_recomendacoes_batch(list(dict.fromkeys(usuarios)), engine, deadline)
+    logger.debug(f"Lote processado: {resultado.get('metadata')}")
+    return jsonify(resultado)
+
+
 @app.route('/health')
 def health_check():
     logger.debug("Health check solicitado")
@@ -276,22 +685,46 @@ def health_check():
         return jsonify({
             "status": "healthy",
             "data_manager": "working",
-            "stats": stats
+            "stats": stats,
+            "cache": data_cache.stats(),
+            "rate_limiter": rate_limiter.stats()
         })
     except Exception as e:
         logger.error(f"Health check falhou: {str(e)}")
         return jsonify({"status": "unhealthy", "error": str(e)}), 500
 
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def api_job_cancel(job_id):
+    if rate_limit_excedido("jobs"):
+        return resposta_rate_limited()
+    job = job_manager.cancel(job_id)
+    if job is None:
+        return jsonify({"status": "not_found", "message": f"Job {job_id} não encontrado"}), 404
+    return jsonify(job)
+
+
 @app.route('/populate', methods=['POST'])
 def populate_data():
-    """Populate initial data"""
+    """Populate initial data in a background job (one populate run at a time)"""
+    if rate_limit_excedido("populate"):
+        return resposta_rate_limited()
     try:
-        from populate_data import populate_initial_data
-        populate_initial_data()
+        payload = request.get_json(silent=True) or {}
+        usuarios = payload.get('usuarios')
+        # Sem "usuarios" o populate usa a lista padrão; se enviada, tem de ser uma lista de nomes
+        if usuarios is not None and (
+                not isinstance(usuarios, list) or not all(isinstance(u, str) for u in usuarios)):
+            return jsonify({
+                "status": "error",
+                "message": "Envie {\"usuarios\": [\"nome1\", \"nome2\", ...]} ou omita para usar a lista padrão"
+            }), 400
+        job = job_manager.submit("populate", {"usuarios": usuarios}, key="populate")
         return jsonify({
-            "status": "success",
-            "message": "Data populated successfully"
-        })
+            "status": "accepted",
+            "message": "Populate running in the background",
+            "job_id": job['id'],
+            "job_url": f"/api/jobs/{job['id']}"
+        }), 202
     except Exception as e:
         logger.error(f"Error populating data: {str(e)}")
         return jsonify({
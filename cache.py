@@ -0,0 +1,98 @@
+"""
+Cache - LRU for values derived from one data version
+
+Everything derived from the ratings (float copies, global film scores, sparse
+matrices) is shared by every request of the same data version. Entries are
+keyed by that version and all dropped as soon as a newer version is seen, so
+they are invalidated exactly when the data changes. Size is bounded by an
+approximate byte count, evicting the least recently used entries first.
+"""
+
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+def approximate_nbytes(value: Any) -> int:
+    """Approximate memory held by a value (arrays, sparse matrices and containers of them)"""
+    if isinstance(value, np.ndarray):
+        # Memory-mapped arrays live in the page cache, not in this process
+        return 0 if isinstance(value, np.memmap) else value.nbytes
+    if hasattr(value, 'indptr') and hasattr(value, 'data'):
+        return value.data.nbytes + value.indices.nbytes + value.indptr.nbytes
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(approximate_nbytes(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(approximate_nbytes(item) for item in value.values())
+    return sys.getsizeof(value)
+
+class VersionedLRUCache:
+    """Thread-safe LRU of (key -> value) for the newest data version, capped at max_bytes"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._version = None
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    def _set_version(self, version: int) -> bool:
+        """Drop every entry when the data moved on; False if version is older than the cached one"""
+        if self._version is None or version > self._version:
+            if self._entries:
+                logger.debug(f"Dados mudaram (v{self._version} -> v{version}), limpando cache")
+            self._entries.clear()
+            self._bytes = 0
+            self._version = version
+        return version == self._version
+
+    def get_or_compute(self, version: int, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """
+        Cached value of key for a data version, computing it on a miss. Values for an
+        older version than the cached one, or larger than the whole cap, are not stored.
+        """
+        with self._lock:
+            if self._set_version(version) and key in self._entries:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return self._entries[key][0]
+            self._misses += 1
+
+        value = compute()
+        size = approximate_nbytes(value)
+
+        with self._lock:
+            if not self._set_version(version) or size > self.max_bytes:
+                return value
+            if key in self._entries:
+                # Computed concurrently by another thread
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "version": self._version,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses
+            }
@@ -1,40 +1,276 @@
 """
 Data Manager - Handles data storage using JSON files instead of PostgreSQL
+
+The JSON files hold a snapshot of the store. Every mutation is appended as
+one line to an append-only journal and replayed on startup; the journal is
+periodically compacted back into the snapshot.
+
+Several processes (e.g. gunicorn workers) may share one data directory:
+writers hold an exclusive fcntl lock on data/.lock, readers take a shared
+lock while (re)loading, and snapshot files are replaced atomically.
 """
 
+import fcntl
+import heapq
 import json
+import math
 import os
-from typing import List, Dict, Tuple, Optional
+import shutil
+import threading
+from contextlib import contextmanager
+from typing import Callable, List, Dict, Tuple, Optional, NamedTuple
 import logging
 
+import numpy as np
+
 logger = logging.getLogger(__name__)
 
+# Number of journal entries after which the journal is folded into the snapshot
+JOURNAL_COMPACT_THRESHOLD = 5000
+
+# Default minimum number of ratings for a movie to count as popular
+POPULAR_MIN_VOTES = 2
+
+class StringTable:
+    """Interns strings as dense integer codes (0..n-1) and decodes them back"""
+
+    def __init__(self, values: Optional[List[str]] = None):
+        self._values: List[str] = []
+        self._codes: Dict[str, int] = {}
+        for value in values or []:
+            self.intern(value)
+
+    def intern(self, value: str) -> int:
+        """Return the code for value, assigning the next one if it is new"""
+        code = self._codes.get(value)
+        if code is None:
+            code = len(self._values)
+            self._codes[value] = code
+            self._values.append(value)
+        return code
+
+    def encode(self, value: str) -> Optional[int]:
+        """Return the code for value, or None if it was never interned"""
+        return self._codes.get(value)
+
+    def decode(self, code: int) -> str:
+        return self._values[code]
+
+    def decode_many(self, codes) -> List[str]:
+        return [self._values[code] for code in codes]
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __iter__(self):
+        return iter(self._values)
+
+class RatingColumns(NamedTuple):
+    """
+    Columnar view of all ratings; user_idx/movie_idx are codes into usernames/titles.
+    Rows are sorted by user (CSR layout): user u owns rows user_indptr[u]:user_indptr[u + 1].
+    """
+    user_idx: np.ndarray  # int32
+    movie_idx: np.ndarray  # int32
+    rating: np.ndarray  # float32
+    user_indptr: np.ndarray  # int64, len(usernames) + 1
+    usernames: StringTable
+    titles: StringTable
+    version: int
+
+    def user_rows(self, user_code: int) -> slice:
+        """Slice of the rows holding one user's ratings"""
+        return slice(int(self.user_indptr[user_code]), int(self.user_indptr[user_code + 1]))
+
+def write_columnar_snapshot(columnar_dir: str, version: int, user_idx: np.ndarray,
+                            movie_idx: np.ndarray, rating: np.ndarray,
+                            usernames: List[str], titles: List[str]):
+    """Write the .npy columnar snapshot of one data version under columnar_dir/v<version>"""
+    version_dir = os.path.join(columnar_dir, f"v{version}")
+
+    # Sort rows by user so each user's ratings are one contiguous slice
+    order = np.argsort(user_idx, kind='stable')
+    user_idx, movie_idx, rating = user_idx[order], movie_idx[order], rating[order]
+    user_indptr = np.zeros(len(usernames) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(user_idx, minlength=len(usernames)), out=user_indptr[1:])
+
+    # Build in a temp dir and rename it into place so readers never see a partial snapshot
+    os.makedirs(columnar_dir, exist_ok=True)
+    tmp_dir = f"{version_dir}.tmp{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    np.save(os.path.join(tmp_dir, "user_idx.npy"), user_idx.astype(np.int32, copy=False))
+    np.save(os.path.join(tmp_dir, "movie_idx.npy"), movie_idx.astype(np.int32, copy=False))
+    np.save(os.path.join(tmp_dir, "rating.npy"), rating.astype(np.float32, copy=False))
+    np.save(os.path.join(tmp_dir, "user_indptr.npy"), user_indptr)
+    with open(os.path.join(tmp_dir, "tables.json"), 'w') as f:
+        json.dump({'version': version, 'usernames': usernames, 'titles': titles}, f)
+    try:
+        os.rename(tmp_dir, version_dir)
+    except OSError:
+        # Another process published this version first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def remove_old_columnar_snapshots(columnar_dir: str, version: int):
+    """
+    Drop versions older than the one before `version`; never touch newer versions,
+    which another process may have just published. Runs under the exclusive lock,
+    so no reader is between finding a version and mapping it; processes that
+    already map a removed version keep its inodes alive.
+    """
+    with _columnar_locked(columnar_dir, exclusive=True):
+        older = sorted(v for v in _snapshot_versions(columnar_dir) if v < version)
+        for old_version in older[:-1]:
+            shutil.rmtree(os.path.join(columnar_dir, f"v{old_version}"), ignore_errors=True)
+
+@contextmanager
+def _columnar_locked(columnar_dir: str, exclusive: bool = False):
+    """Lock on a columnar dir (shared while opening a version, exclusive while removing old ones)"""
+    os.makedirs(columnar_dir, exist_ok=True)
+    with open(os.path.join(columnar_dir, ".lock"), 'a') as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+def _snapshot_versions(columnar_dir: str) -> List[int]:
+    versions = []
+    for name in os.listdir(columnar_dir):
+        if name.startswith("v") and '.tmp' not in name:
+            try:
+                versions.append(int(name[1:]))
+            except ValueError:
+                continue
+    return versions
+
+def load_columnar_snapshot(version_dir: str) -> RatingColumns:
+    """Open a columnar snapshot with the arrays memory-mapped read-only"""
+    with open(os.path.join(version_dir, "tables.json")) as f:
+        tables = json.load(f)
+    return RatingColumns(
+        user_idx=np.load(os.path.join(version_dir, "user_idx.npy"), mmap_mode='r'),
+        movie_idx=np.load(os.path.join(version_dir, "movie_idx.npy"), mmap_mode='r'),
+        rating=np.load(os.path.join(version_dir, "rating.npy"), mmap_mode='r'),
+        user_indptr=np.load(os.path.join(version_dir, "user_indptr.npy"), mmap_mode='r'),
+        usernames=StringTable(tables['usernames']),
+        titles=StringTable(tables['titles']),
+        version=tables['version'],
+    )
+
+def open_columnar_snapshot(columnar_dir: str, version: int, write: Callable[[], int]) -> RatingColumns:
+    """
+    Map snapshot v<version>, first calling write() (which publishes a snapshot and
+    returns its version) when it does not exist. The shared lock is held from the
+    check to the mmap, so old versions are only removed once nobody is opening them.
+    """
+    with _columnar_locked(columnar_dir):
+        if not os.path.exists(os.path.join(columnar_dir, f"v{version}", "tables.json")):
+            version = write()
+        columns = load_columnar_snapshot(os.path.join(columnar_dir, f"v{version}"))
+    remove_old_columnar_snapshots(columnar_dir, version)
+    return columns
+
+def create_data_manager(data_dir="data"):
+    """Create the storage backend selected by the DATA_BACKEND env var ('json' or 'sqlite')"""
+    backend = os.environ.get("DATA_BACKEND", "json").lower()
+    if backend == "sqlite":
+        from sqlite_data_manager import SQLiteDataManager
+        return SQLiteDataManager(data_dir)
+    if backend != "json":
+        logger.warning(f"Unknown DATA_BACKEND '{backend}', using JSON files")
+    return DataManager(data_dir)
+
 class DataManager:
-    def __init__(self, data_dir="data"):
+    def __init__(self, data_dir="data", compact_threshold: int = JOURNAL_COMPACT_THRESHOLD):
         self.data_dir = data_dir
         self.users_file = os.path.join(data_dir, "users.json")
         self.movies_file = os.path.join(data_dir, "movies.json")
         self.ratings_file = os.path.join(data_dir, "ratings.json")
+        self.meta_file = os.path.join(data_dir, "meta.json")
+        self.journal_file = os.path.join(data_dir, "journal.log")
+        self.stats_file = os.path.join(data_dir, "stats.json")
+        self.columnar_dir = os.path.join(data_dir, "columnar")
+        # Fitted models are tied to this backend's version numbers
+        self.model_dir = os.path.join(data_dir, "models")
+        self.lock_file = os.path.join(data_dir, ".lock")
+        self.compact_threshold = compact_threshold
         
         # Create data directory if it doesn't exist
         os.makedirs(data_dir, exist_ok=True)
         
+        # Serializes threads of this process; the file lock serializes processes
+        self._thread_lock = threading.RLock()
+        self._lock_handle = None
+
         # Initialize files if they don't exist
-        self._init_files()
+        with self._locked(exclusive=True):
+            self._init_files()
+            self._recover_journal()
+
+        # In-memory indexes, rebuilt only when the snapshot changes on disk
+        self._snapshot_signature: Optional[Tuple] = None
+        self._journal_offset = 0
+        self._journal_entries = 0
+        self._seq = 0
+        self._user_ids: Dict[str, int] = {}
+        self._user_names: Dict[int, str] = {}
+        self._movie_ids: Dict[str, int] = {}
+        self._movie_titles: Dict[int, str] = {}
+        self._ratings: Dict[Tuple[int, int], float] = {}
+        self._user_movies: Dict[int, List[int]] = {}  # user_id -> rated movie ids
+        self._movie_stats: Dict[int, List[float]] = {}  # movie_id -> [sum, count, sum of squares]
+        self._rating_sum = 0.0
+        self._columns: Optional[RatingColumns] = None
+        self._stats_signature: Optional[Tuple[int, int]] = None
+        self._stats: Dict = {}
+        self._refresh()
+
+        # Counters for get_stats live in a small file kept up to date on every write
+        if not isinstance(self._load_data(self.stats_file), dict):
+            with self._locked(exclusive=True):
+                self._refresh()
+                self._save_stats()
     
+    @contextmanager
+    def _locked(self, exclusive: bool = False):
+        """Hold the data directory lock (shared for readers, exclusive for writers)"""
+        with self._thread_lock:
+            if self._lock_handle is not None:
+                # Already held by this thread further up the stack
+                yield
+                return
+            with open(self.lock_file, 'a') as handle:
+                fcntl.flock(handle, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                self._lock_handle = handle
+                try:
+                    yield
+                finally:
+                    self._lock_handle = None
+                    fcntl.flock(handle, fcntl.LOCK_UN)
+
     def _init_files(self):
         """Initialize JSON files if they don't exist"""
         if not os.path.exists(self.users_file):
-            with open(self.users_file, 'w') as f:
-                json.dump([], f)
+            self._save_data(self.users_file, [])
         
         if not os.path.exists(self.movies_file):
-            with open(self.movies_file, 'w') as f:
-                json.dump([], f)
+            self._save_data(self.movies_file, [])
         
         if not os.path.exists(self.ratings_file):
-            with open(self.ratings_file, 'w') as f:
-                json.dump([], f)
+            self._save_data(self.ratings_file, [])
+
+        if not os.path.exists(self.journal_file):
+            open(self.journal_file, 'a').close()
+    
+    def _recover_journal(self):
+        """Drop a torn trailing line left by a crash in the middle of an append"""
+        with open(self.journal_file, 'rb+') as f:
+            content = f.read()
+            if content and not content.endswith(b'\n'):
+                valid_size = content.rfind(b'\n') + 1
+                logger.warning(f"Truncating incomplete journal entry in {self.journal_file}")
+                f.truncate(valid_size)
     
     def _load_data(self, file_path: str) -> List[Dict]:
         """Load data from JSON file"""
@@ -44,81 +280,260 @@ class DataManager:
         except (FileNotFoundError, json.JSONDecodeError):
             return []
     
-    def _save_data(self, file_path: str, data: List[Dict]):
-        """Save data to JSON file"""
-        with open(file_path, 'w') as f:
+    def _save_data(self, file_path: str, data):
+        """Save data to JSON file (write to a temp file, then atomically rename it)"""
+        tmp_path = f"{file_path}.tmp{os.getpid()}"
+        with open(tmp_path, 'w') as f:
             json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
     
+    def _file_signature(self, file_path: str) -> Tuple[int, int]:
+        """Return (mtime_ns, size) for a file, used to detect changes"""
+        try:
+            st = os.stat(file_path)
+        except FileNotFoundError:
+            return (0, 0)
+        return (st.st_mtime_ns, st.st_size)
+
+    def _current_snapshot_signature(self) -> Tuple:
+        return tuple(
+            self._file_signature(file_path)
+            for file_path in (self.users_file, self.movies_file, self.ratings_file, self.meta_file)
+        )
+
+    def _refresh(self):
+        """Bring the indexes up to date with the snapshot and the journal tail"""
+        signature = self._current_snapshot_signature()
+        journal_size = self._file_signature(self.journal_file)[1]
+        if signature == self._snapshot_signature and journal_size == self._journal_offset:
+            return
+
+        # Something changed: re-check under the shared lock so a concurrent
+        # compaction or append is never observed half-way through
+        with self._locked():
+            signature = self._current_snapshot_signature()
+            journal_size = self._file_signature(self.journal_file)[1]
+            if signature != self._snapshot_signature or journal_size < self._journal_offset:
+                logger.debug(f"Reloading snapshot from {self.data_dir}")
+                self._load_snapshot()
+                self._snapshot_signature = signature
+                self._journal_offset = 0
+                self._journal_entries = 0
+            if journal_size > self._journal_offset:
+                self._replay_journal()
+
+    def _load_snapshot(self):
+        users = self._load_data(self.users_file)
+        movies = self._load_data(self.movies_file)
+        ratings = self._load_data(self.ratings_file)
+        self._user_ids = {user['username']: user['id'] for user in users}
+        self._user_names = {user['id']: user['username'] for user in users}
+        self._movie_ids = {movie['title']: movie['id'] for movie in movies}
+        self._movie_titles = {movie['id']: movie['title'] for movie in movies}
+        self._ratings = {
+            (rating_data['user_id'], rating_data['movie_id']): rating_data['rating']
+            for rating_data in ratings
+        }
+        self._user_movies = {}
+        self._movie_stats = {}
+        self._rating_sum = 0.0
+        for (user_id, movie_id), rating in self._ratings.items():
+            self._user_movies.setdefault(user_id, []).append(movie_id)
+            self._add_to_movie_stats(movie_id, rating, 1)
+        meta = self._load_data(self.meta_file)
+        self._seq = meta.get('seq', 0) if isinstance(meta, dict) else 0
+
+    def _replay_journal(self):
+        """Apply the journal entries written since the last read"""
+        with open(self.journal_file, 'rb') as f:
+            f.seek(self._journal_offset)
+            chunk = f.read()
+        # Only consume complete lines; a partial one is still being written
+        end = chunk.rfind(b'\n') + 1
+        for line in chunk[:end].splitlines():
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping corrupt journal entry: {line[:80]!r}")
+                continue
+            self._journal_entries += 1
+            # Entries already folded into the snapshot are skipped
+            if entry['seq'] > self._seq:
+                self._apply(entry)
+        self._journal_offset += end
+
+    def _apply(self, entry: Dict):
+        """Apply one journal entry to the in-memory indexes"""
+        op = entry['op']
+        if op == 'user':
+            self._user_ids[entry['username']] = entry['id']
+            self._user_names[entry['id']] = entry['username']
+        elif op == 'movie':
+            self._movie_ids[entry['title']] = entry['id']
+            self._movie_titles[entry['id']] = entry['title']
+        elif op == 'rating':
+            key = (entry['user_id'], entry['movie_id'])
+            old_rating = self._ratings.get(key)
+            if old_rating is None:
+                self._user_movies.setdefault(entry['user_id'], []).append(entry['movie_id'])
+            else:
+                self._add_to_movie_stats(entry['movie_id'], old_rating, -1)
+            self._add_to_movie_stats(entry['movie_id'], entry['rating'], 1)
+            self._ratings[key] = entry['rating']
+        self._seq = entry['seq']
+
+    def _add_to_movie_stats(self, movie_id: int, rating: float, sign: int):
+        """Add (sign=1) or remove (sign=-1) one rating from the running aggregates"""
+        stats = self._movie_stats.setdefault(movie_id, [0.0, 0, 0.0])
+        stats[0] += sign * rating
+        stats[1] += sign
+        stats[2] += sign * rating * rating
+        self._rating_sum += sign * rating
+
+    def _append(self, entries: List[Dict]):
+        """
+        Durably append mutations to the journal, then apply them in memory.
+        Callers must hold the exclusive lock and have refreshed first.
+        """
+        lines = []
+        for seq, entry in enumerate(entries, start=self._seq + 1):
+            entry['seq'] = seq
+            lines.append(json.dumps(entry))
+        # With the exclusive lock held no other writer is active, so bytes past the
+        # last line we consumed are a torn write (e.g. a worker killed mid-append):
+        # drop them, or our first line would be glued onto the fragment
+        if os.path.getsize(self.journal_file) > self._journal_offset:
+            logger.warning(f"Truncating incomplete journal entry in {self.journal_file}")
+            os.truncate(self.journal_file, self._journal_offset)
+        with open(self.journal_file, 'a') as f:
+            f.write('\n'.join(lines) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+            self._journal_offset = f.tell()
+        for entry in entries:
+            self._apply(entry)
+        self._journal_entries += len(entries)
+        self._save_stats()
+        if self._journal_entries >= self.compact_threshold:
+            self._compact()
+
+    def _save_stats(self):
+        """Persist the store counters; cheap because they come from the indexes"""
+        self._save_data(self.stats_file, {
+            'seq': self._seq,
+            'total_users': len(self._user_ids),
+            'total_movies': len(self._movie_ids),
+            'total_ratings': len(self._ratings)
+        })
+
+    def compact(self):
+        """Fold the journal into the JSON snapshot and truncate it"""
+        with self._locked(exclusive=True):
+            self._refresh()
+            self._compact()
+
+    def _compact(self):
+        logger.info(f"Compacting journal ({self._journal_entries} entries) into snapshot")
+        self._save_data(self.users_file, [
+            {'id': user_id, 'username': name}
+            for user_id, name in self._user_names.items()
+        ])
+        self._save_data(self.movies_file, [
+            {'id': movie_id, 'title': title}
+            for movie_id, title in self._movie_titles.items()
+        ])
+        self._save_data(self.ratings_file, [
+            {'user_id': user_id, 'movie_id': movie_id, 'rating': rating}
+            for (user_id, movie_id), rating in self._ratings.items()
+        ])
+        # The snapshot is complete once meta records its seq; only then drop the journal
+        self._save_data(self.meta_file, {'seq': self._seq})
+        with open(self.journal_file, 'w') as f:
+            f.flush()
+            os.fsync(f.fileno())
+        self._snapshot_signature = self._current_snapshot_signature()
+        self._journal_offset = 0
+        self._journal_entries = 0
+
     def get_user_id(self, username: str) -> Optional[int]:
         """Get user ID by username"""
-        users = self._load_data(self.users_file)
-        for user in users:
-            if user['username'] == username:
-                return user['id']
-        return None
+        self._refresh()
+        return self._user_ids.get(username)
     
     def add_user(self, username: str) -> int:
         """Add user and return user ID"""
-        users = self._load_data(self.users_file)
-        
-        # Check if user already exists
-        for user in users:
-            if user['username'] == username:
-                return user['id']
-        
-        # Add new user
-        new_id = len(users) + 1
-        users.append({
-            'id': new_id,
-            'username': username
-        })
-        self._save_data(self.users_file, users)
-        return new_id
+        with self._locked(exclusive=True):
+            self._refresh()
+            
+            # Check if user already exists
+            if username in self._user_ids:
+                return self._user_ids[username]
+            
+            # Add new user
+            new_id = len(self._user_ids) + 1
+            self._append([{'op': 'user', 'id': new_id, 'username': username}])
+            return new_id
     
     def get_movie_id(self, title: str) -> Optional[int]:
         """Get movie ID by title"""
-        movies = self._load_data(self.movies_file)
-        for movie in movies:
-            if movie['title'] == title:
-                return movie['id']
-        return None
+        self._refresh()
+        return self._movie_ids.get(title)
     
     def add_movie(self, title: str) -> int:
         """Add movie and return movie ID"""
-        movies = self._load_data(self.movies_file)
-        
-        # Check if movie already exists
-        for movie in movies:
-            if movie['title'] == title:
-                return movie['id']
-        
-        # Add new movie
-        new_id = len(movies) + 1
-        movies.append({
-            'id': new_id,
-            'title': title
-        })
-        self._save_data(self.movies_file, movies)
-        return new_id
+        with self._locked(exclusive=True):
+            self._refresh()
+            
+            # Check if movie already exists
+            if title in self._movie_ids:
+                return self._movie_ids[title]
+            
+            # Add new movie
+            new_id = len(self._movie_ids) + 1
+            self._append([{'op': 'movie', 'id': new_id, 'title': title}])
+            return new_id
     
     def add_rating(self, user_id: int, movie_id: int, rating: float):
-        """Add rating"""
-        ratings = self._load_data(self.ratings_file)
-        
-        # Check if rating already exists
-        for rating_data in ratings:
-            if rating_data['user_id'] == user_id and rating_data['movie_id'] == movie_id:
-                rating_data['rating'] = rating
-                self._save_data(self.ratings_file, ratings)
-                return
-        
-        # Add new rating
-        ratings.append({
-            'user_id': user_id,
-            'movie_id': movie_id,
-            'rating': rating
-        })
-        self._save_data(self.ratings_file, ratings)
+        """Add rating (or update it if it already exists)"""
+        with self._locked(exclusive=True):
+            self._refresh()
+            self._append([{'op': 'rating', 'user_id': user_id, 'movie_id': movie_id, 'rating': rating}])
+    
+    def add_ratings_bulk(self, username: str, ratings: List[Tuple[str, Optional[float]]]) -> int:
+        """
+        Add a user's (title, rating) pairs in one pass and a single journal write.
+        Missing user/movies are created; pairs with a None rating only register the movie.
+        Returns the number of ratings upserted.
+        """
+        with self._locked(exclusive=True):
+            self._refresh()
+            entries = []
+
+            user_id = self._user_ids.get(username)
+            if user_id is None:
+                user_id = len(self._user_ids) + 1
+                entries.append({'op': 'user', 'id': user_id, 'username': username})
+
+            new_movies: Dict[str, int] = {}
+            rated: Dict[int, float] = {}
+            for title, rating in ratings:
+                movie_id = self._movie_ids.get(title) or new_movies.get(title)
+                if movie_id is None:
+                    movie_id = len(self._movie_ids) + len(new_movies) + 1
+                    new_movies[title] = movie_id
+                    entries.append({'op': 'movie', 'id': movie_id, 'title': title})
+                if rating is not None:
+                    rated[movie_id] = rating
+
+            entries.extend(
+                {'op': 'rating', 'user_id': user_id, 'movie_id': movie_id, 'rating': rating}
+                for movie_id, rating in rated.items()
+            )
+            if entries:
+                self._append(entries)
+            return len(rated)
     
     def get_user_ratings(self, username: str) -> List[Tuple[str, float]]:
         """Get user ratings as list of (title, rating) tuples"""
@@ -126,76 +541,130 @@ class DataManager:
         if not user_id:
             return []
         
-        ratings = self._load_data(self.ratings_file)
-        movies = self._load_data(self.movies_file)
-        
-        # Create movie ID to title mapping
-        movie_id_to_title = {movie['id']: movie['title'] for movie in movies}
-        
-        # Get user's ratings
-        user_ratings = []
-        for rating_data in ratings:
-            if rating_data['user_id'] == user_id:
-                movie_title = movie_id_to_title.get(rating_data['movie_id'])
+        with self._thread_lock:
+            # Get user's ratings through the per-user index
+            user_ratings = []
+            for movie_id in self._user_movies.get(user_id, []):
+                movie_title = self._movie_titles.get(movie_id)
                 if movie_title:
-                    user_ratings.append((movie_title, rating_data['rating']))
-        
-        return user_ratings
+                    user_ratings.append((movie_title, self._ratings[(user_id, movie_id)]))
+            
+            return user_ratings
     
     def get_all_ratings(self) -> List[Tuple[str, str, float]]:
         """Get all ratings as list of (username, title, rating) tuples"""
-        users = self._load_data(self.users_file)
-        movies = self._load_data(self.movies_file)
-        ratings = self._load_data(self.ratings_file)
-        
-        # Create ID to name mappings
-        user_id_to_name = {user['id']: user['username'] for user in users}
-        movie_id_to_title = {movie['id']: movie['title'] for movie in movies}
+        self._refresh()
         
-        # Get all ratings
-        all_ratings = []
-        for rating_data in ratings:
-            username = user_id_to_name.get(rating_data['user_id'])
-            movie_title = movie_id_to_title.get(rating_data['movie_id'])
-            if username and movie_title:
-                all_ratings.append((username, movie_title, rating_data['rating']))
-        
-        return all_ratings
+        with self._thread_lock:
+            # Get all ratings
+            all_ratings = []
+            for (user_id, movie_id), rating in self._ratings.items():
+                username = self._user_names.get(user_id)
+                movie_title = self._movie_titles.get(movie_id)
+                if username and movie_title:
+                    all_ratings.append((username, movie_title, rating))
+            
+            return all_ratings
     
-    def get_popular_movies(self, limit: int = 10) -> List[Tuple[str, float]]:
-        """Get popular movies as list of (title, avg_rating) tuples"""
-        all_ratings = self.get_all_ratings()
-        
-        # Group by movie title
-        movie_ratings = {}
-        for username, title, rating in all_ratings:
-            if title not in movie_ratings:
-                movie_ratings[title] = []
-            movie_ratings[title].append(rating)
-        
-        # Calculate average ratings
-        popular_movies = []
-        for title, ratings in movie_ratings.items():
-            if len(ratings) >= 2:  # At least 2 ratings
-                avg_rating = sum(ratings) / len(ratings)
-                popular_movies.append((title, avg_rating))
-        
-        # Sort by average rating and return top movies
-        popular_movies.sort(key=lambda x: x[1], reverse=True)
-        return popular_movies[:limit]
+    def get_ratings_columns(self) -> RatingColumns:
+        """
+        Get all ratings as int32/float32 columns plus string tables.
+        The arrays are memory-mapped from a per-version .npy snapshot, so they are
+        zero-copy and shared between worker processes through the page cache.
+        """
+        self._refresh()
+        with self._thread_lock:
+            if self._columns is not None and self._columns.version == self._seq:
+                return self._columns
+
+            self._columns = open_columnar_snapshot(self.columnar_dir, self._seq, self._write_columns)
+            return self._columns
+
+    def _write_columns(self) -> int:
+        """Write the columnar snapshot of the loaded state (caller holds _thread_lock)"""
+        logger.info(f"Building columnar ratings snapshot v{self._seq}")
+        user_ids = sorted(self._user_names)
+        movie_ids = sorted(self._movie_titles)
+        user_pos = {user_id: idx for idx, user_id in enumerate(user_ids)}
+        movie_pos = {movie_id: idx for idx, movie_id in enumerate(movie_ids)}
+        rows = [
+            (user_pos[user_id], movie_pos[movie_id], rating)
+            for (user_id, movie_id), rating in self._ratings.items()
+            if user_id in user_pos and movie_id in movie_pos
+        ]
+        write_columnar_snapshot(
+            self.columnar_dir, self._seq,
+            user_idx=np.fromiter((row[0] for row in rows), dtype=np.int32, count=len(rows)),
+            movie_idx=np.fromiter((row[1] for row in rows), dtype=np.int32, count=len(rows)),
+            rating=np.fromiter((row[2] for row in rows), dtype=np.float32, count=len(rows)),
+            usernames=[self._user_names[user_id] for user_id in user_ids],
+            titles=[self._movie_titles[movie_id] for movie_id in movie_ids],
+        )
+        return self._seq
+    
+    def get_popular_movies(self, limit: int = 10, min_votes: int = POPULAR_MIN_VOTES,
+                           mode: str = 'mean', prior_votes: Optional[float] = None) -> List[Tuple[str, float]]:
+        """
+        Get popular movies as list of (title, score) tuples from the per-movie aggregates.
+        mode='mean' ranks by average rating; mode='bayesian' shrinks each average towards
+        the global mean with weight prior_votes (default: average ratings per movie).
+        """
+        self._refresh()
+        with self._thread_lock:
+            if mode == 'bayesian':
+                n_movies = len(self._movie_stats) or 1
+                global_mean = self._rating_sum / len(self._ratings) if self._ratings else 0.0
+                prior = prior_votes if prior_votes is not None else len(self._ratings) / n_movies
+                scores = (
+                    ((prior * global_mean + total) / (prior + count), movie_id)
+                    for movie_id, (total, count, _) in self._movie_stats.items()
+                    if count >= min_votes and movie_id in self._movie_titles
+                )
+            else:
+                scores = (
+                    (total / count, movie_id)
+                    for movie_id, (total, count, _) in self._movie_stats.items()
+                    if count >= min_votes and count > 0 and movie_id in self._movie_titles
+                )
+            top = heapq.nlargest(limit, scores, key=lambda x: x[0])
+            return [(self._movie_titles[movie_id], score) for score, movie_id in top]
+    
+    def get_movie_stats(self, title: str) -> Optional[Dict]:
+        """Get count, mean and standard deviation of a movie's ratings"""
+        movie_id = self.get_movie_id(title)
+        stats = self._movie_stats.get(movie_id)
+        if not stats or stats[1] <= 0:
+            return None
+        total, count, total_sq = stats
+        mean = total / count
+        return {
+            'count': int(count),
+            'mean': mean,
+            'std': math.sqrt(max(total_sq / count - mean * mean, 0.0))
+        }
     
     def user_exists(self, username: str) -> bool:
         """Check if user exists"""
         return self.get_user_id(username) is not None
     
     def get_stats(self) -> Dict:
-        """Get database statistics"""
-        users = self._load_data(self.users_file)
-        movies = self._load_data(self.movies_file)
-        ratings = self._load_data(self.ratings_file)
+        """Get database statistics from the counters file, without touching the bulk data"""
+        signature = self._file_signature(self.stats_file)
+        if signature != self._stats_signature:
+            stats = self._load_data(self.stats_file)
+            if not isinstance(stats, dict):
+                # Counters missing or unreadable: fall back to the indexes
+                self._refresh()
+                stats = {
+                    'total_users': len(self._user_ids),
+                    'total_movies': len(self._movie_ids),
+                    'total_ratings': len(self._ratings)
+                }
+            self._stats = stats
+            self._stats_signature = signature
         
         return {
-            'total_users': len(users),
-            'total_movies': len(movies),
-            'total_ratings': len(ratings)
+            'total_users': self._stats.get('total_users', 0),
+            'total_movies': self._stats.get('total_movies', 0),
+            'total_ratings': self._stats.get('total_ratings', 0)
         }
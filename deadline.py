@@ -0,0 +1,38 @@
+"""
+Deadline - Cooperative time budget for a request
+
+A Deadline is created when a request starts and passed down the pipeline;
+each stage calls check() before doing more work. Unlike signal.alarm it
+works in any thread (gthread/gevent workers, background threads) and never
+interrupts a library call half way.
+"""
+
+import time
+from typing import Optional
+
+class DeadlineExceeded(TimeoutError):
+    """Raised by Deadline.check() once the time budget is spent"""
+
+class Deadline:
+    """Absolute point in time (monotonic clock) by which a request must answer"""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def check(self, stage: str = ""):
+        """Raise DeadlineExceeded if the budget is spent (stage names where it happened)"""
+        if self.expired():
+            where = f" em {stage}" if stage else ""
+            raise DeadlineExceeded(f"Prazo de {self.seconds}s esgotado{where}")
+
+def check_deadline(deadline: Optional[Deadline], stage: str = ""):
+    """Deadline.check() that accepts None (no time limit)"""
+    if deadline is not None:
+        deadline.check(stage)
@@ -7,7 +7,10 @@ bind = "0.0.0.0:" + os.environ.get("PORT", "5000")
 backlog = 2048
 
 # Worker processes
-workers = 1  # Single worker for heavy ML operations
+# DataManager writes are file-locked and atomic, so workers can share the data dir.
+# Each worker keeps its own models, caches and rate limits in memory, so start
+# conservatively; set WEB_CONCURRENCY to run more on hosts with spare RAM/cores.
+workers = int(os.environ.get("WEB_CONCURRENCY", min(2, multiprocessing.cpu_count())))
 worker_class = "sync"
 worker_connections = 50
 max_requests = 50
@@ -47,4 +50,10 @@ preload_app = True
 
 # Worker timeout
 worker_tmp_dir = "/dev/shm"
-worker_exit_on_app_exit = True 
\ No newline at end of file
+worker_exit_on_app_exit = True 
+
+def post_fork(server, worker):
+    # Background jobs run on threads of each worker (threads do not survive the fork):
+    # start them right away so jobs left by a dead worker resume without waiting for a request
+    from app import job_manager
+    job_manager.start()
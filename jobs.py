@@ -0,0 +1,299 @@
+"""
+Jobs - Background jobs with a job table shared between worker processes
+
+Each job is one JSON file under data/jobs (written atomically), so any gunicorn
+worker can report its status. Jobs run on a small thread pool in the process
+that submitted them; the pool is created on first use in each process, so a
+manager built before gunicorn forks its workers is safe to share. A job can
+carry a key (e.g. the username being scraped): while a job with that key is
+queued or running, submitting it again returns the existing job instead of
+starting a second one.
+
+Jobs can be cancelled from any process; the job function notices it between
+steps. A job whose owning process died (e.g. a restart, or a worker recycled
+by max_requests) is taken over, with the progress it had saved, when a process
+starts its pool or finds the job while looking up or submitting its key.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+import logging
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+# Threads per process running jobs
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+# Finished jobs are removed after this many seconds
+JOB_RETENTION = int(os.environ.get("JOB_RETENTION", 24 * 3600))
+
+ACTIVE_STATUSES = ("queued", "running")
+
+class JobCancelled(Exception):
+    """Raised by a job function that stopped because the job was cancelled"""
+
+def _process_owner(pid: int) -> Optional[str]:
+    """Identity of a live process (pid plus start time, so a reused pid does not match)"""
+    try:
+        return f"{pid}:{psutil.Process(pid).create_time()}"
+    except psutil.Error:
+        return None
+
+class Job:
+    """Handle passed to a job function: its parameters, saved progress and cancellation"""
+
+    def __init__(self, manager: "JobManager", record: Dict):
+        self.manager = manager
+        self.id = record['id']
+        self.params = record['params']
+        # Progress saved by a previous run when the job is resumed
+        self.progress = record.get('progress') or {}
+
+    def update(self, **fields):
+        """Merge fields into the job record (e.g. progress=...)"""
+        self.manager._update(self.id, **fields)
+
+    def cancelled(self) -> bool:
+        record = self.manager.get(self.id)
+        return record is None or bool(record.get('cancel_requested'))
+
+class JobManager:
+    """Persistent job table plus the thread pool that runs this process' jobs"""
+
+    def __init__(self, jobs_dir: str, max_workers: int = JOB_WORKERS):
+        self.jobs_dir = jobs_dir
+        self.active_dir = os.path.join(jobs_dir, "active")
+        os.makedirs(self.active_dir, exist_ok=True)
+        self.lock_file = os.path.join(jobs_dir, ".lock")
+        self.max_workers = max_workers
+        self._handlers: Dict[str, Callable[[Job], object]] = {}
+        # Thread pool and the pid it belongs to (threads do not survive a fork)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_pid: Optional[int] = None
+        self._thread_lock = threading.RLock()
+        self._owners: Dict[int, Optional[str]] = {}
+
+    @property
+    def _owner(self) -> Optional[str]:
+        """Identity of the current process (resolved per pid: workers may be forked after import)"""
+        pid = os.getpid()
+        if pid not in self._owners:
+            self._owners[pid] = _process_owner(pid)
+        return self._owners[pid]
+
+    def start(self) -> int:
+        """
+        Create this process' thread pool and resume orphaned jobs; does nothing if already
+        started in this process (call it after a fork, e.g. from gunicorn's post_fork).
+        Returns how many jobs were resumed.
+        """
+        pid = os.getpid()
+        with self._thread_lock:
+            if self._executor_pid == pid:
+                return 0
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="job")
+            self._executor_pid = pid
+        return self.resume()
+
+    def _start_run(self, record: Dict):
+        self.start()
+        self._executor.submit(self._run, record)
+
+    def _orphaned(self, record: Dict) -> bool:
+        """Whether an active job belongs to a process that is gone (and this process can run it)"""
+        if record['kind'] not in self._handlers:
+            return False
+        owner = record.get('owner')
+        pid = int(owner.split(':')[0]) if owner else None
+        return pid is None or _process_owner(pid) != owner
+
+    def _claim(self, record: Dict) -> Dict:
+        """Take over an orphaned job (caller holds the lock and then runs it)"""
+        record.update(owner=self._owner, status='queued', updated_at=time.time())
+        self._write(record)
+        return record
+
+    @contextmanager
+    def _locked(self):
+        """Exclusive lock on the job table across processes"""
+        with self._thread_lock, open(self.lock_file, 'a') as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def _job_path(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def _active_path(self, kind: str, key: str) -> str:
+        digest = hashlib.sha1(f"{kind}:{key}".encode('utf-8')).hexdigest()
+        return os.path.join(self.active_dir, digest)
+
+    def _write(self, record: Dict):
+        path = self._job_path(record['id'])
+        tmp_path = f"{path}.tmp{os.getpid()}.{threading.get_ident()}"
+        with open(tmp_path, 'w') as f:
+            json.dump(record, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _update(self, job_id: str, **fields) -> Optional[Dict]:
+        with self._locked():
+            record = self.get(job_id)
+            if record is None:
+                return None
+            record.update(fields, updated_at=time.time())
+            self._write(record)
+            if record['status'] not in ACTIVE_STATUSES and record.get('key') is not None:
+                try:
+                    os.remove(self._active_path(record['kind'], record['key']))
+                except FileNotFoundError:
+                    pass
+            return record
+
+    def register(self, kind: str, handler: Callable[[Job], object]):
+        """Function run for jobs of a kind; its return value becomes the job result"""
+        self._handlers[kind] = handler
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        if not job_id or not all(c in "0123456789abcdef" for c in job_id):
+            return None
+        try:
+            with open(self._job_path(job_id)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _active_record(self, kind: str, key: str) -> Optional[Dict]:
+        try:
+            with open(self._active_path(kind, key)) as f:
+                record = self.get(f.read().strip())
+        except FileNotFoundError:
+            return None
+        if record is not None and record['status'] in ACTIVE_STATUSES:
+            return record
+        return None
+
+    def find_active(self, kind: str, key: str) -> Optional[Dict]:
+        """
+        Queued or running job of a kind for a key, if any (O(1): one small file read).
+        A job left behind by a dead process is taken over so it does not stay pending forever.
+        """
+        record = self._active_record(kind, key)
+        if record is None or not self._orphaned(record):
+            return record
+        with self._locked():
+            record = self._active_record(kind, key)
+            if record is None or not self._orphaned(record):
+                return record
+            record = self._claim(record)
+        logger.info(f"Retomando job órfão {record['id']} ({kind})")
+        self._start_run(record)
+        return record
+
+    def submit(self, kind: str, params: Optional[Dict] = None, key: Optional[str] = None) -> Dict:
+        """Queue a job (or return the active one with the same kind and key)"""
+        if kind not in self._handlers:
+            raise ValueError(f"Tipo de job desconhecido: {kind}")
+        with self._locked():
+            existing = self._active_record(kind, key) if key is not None else None
+            if existing is not None:
+                if not self._orphaned(existing):
+                    return existing
+                # Left behind by a dead process: run it here, with its saved progress
+                record = self._claim(existing)
+            else:
+                now = time.time()
+                record = {
+                    'id': uuid.uuid4().hex,
+                    'kind': kind,
+                    'key': key,
+                    'status': 'queued',
+                    'params': params or {},
+                    'progress': {},
+                    'result': None,
+                    'error': None,
+                    'owner': self._owner,
+                    'created_at': now,
+                    'updated_at': now
+                }
+                self._write(record)
+                if key is not None:
+                    with open(self._active_path(kind, key), 'w') as f:
+                        f.write(record['id'])
+        if existing is not None:
+            logger.info(f"Retomando job órfão {record['id']} ({kind})")
+        else:
+            logger.info(f"Job {record['id']} ({kind}) enfileirado")
+        self._start_run(record)
+        self._prune()
+        return record
+
+    def cancel(self, job_id: str) -> Optional[Dict]:
+        """Ask a job to stop; a queued job is cancelled right away"""
+        with self._locked():
+            record = self.get(job_id)
+            if record is None or record['status'] not in ACTIVE_STATUSES:
+                return record
+        if record['status'] == 'queued':
+            return self._update(job_id, status='cancelled', cancel_requested=True, finished_at=time.time())
+        logger.info(f"Cancelamento solicitado para o job {job_id}")
+        return self._update(job_id, cancel_requested=True)
+
+    def resume(self) -> int:
+        """Take over active jobs whose owning process is gone; returns how many were resumed"""
+        resumed = []
+        with self._locked():
+            for name in os.listdir(self.jobs_dir):
+                if not name.endswith(".json"):
+                    continue
+                record = self.get(name[:-len(".json")])
+                if record is not None and record['status'] in ACTIVE_STATUSES and self._orphaned(record):
+                    resumed.append(self._claim(record))
+        for record in resumed:
+            logger.info(f"Retomando job {record['id']} ({record['kind']})")
+            self._start_run(record)
+        return len(resumed)
+
+    def _run(self, record: Dict):
+        job_id = record['id']
+        current = self._update(job_id, status='running', started_at=time.time(), owner=self._owner)
+        if current is None or current.get('cancel_requested'):
+            self._update(job_id, status='cancelled', finished_at=time.time())
+            return
+        try:
+            result = self._handlers[record['kind']](Job(self, current))
+        except JobCancelled:
+            logger.info(f"Job {job_id} ({record['kind']}) cancelado")
+            self._update(job_id, status='cancelled', finished_at=time.time())
+        except Exception as e:
+            logger.error(f"Job {job_id} ({record['kind']}) falhou: {str(e)}")
+            self._update(job_id, status='failed', error=str(e), finished_at=time.time())
+        else:
+            logger.info(f"Job {job_id} ({record['kind']}) concluído")
+            self._update(job_id, status='done', result=result, finished_at=time.time())
+
+    def _prune(self):
+        """Remove finished jobs older than JOB_RETENTION"""
+        cutoff = time.time() - JOB_RETENTION
+        for name in os.listdir(self.jobs_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.jobs_dir, name)
+            try:
+                if os.path.getmtime(path) >= cutoff:
+                    continue
+                record = self.get(name[:-len(".json")])
+                if record is not None and record['status'] not in ACTIVE_STATUSES:
+                    os.remove(path)
+            except OSError:
+                continue
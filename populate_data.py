@@ -6,16 +6,34 @@ Uses the existing scrap.py functions
 
 import time
 import sys
-from typing import List, Tuple, Optional
+from typing import Callable, Iterable, List, Tuple, Optional
 import requests
 from bs4 import BeautifulSoup
 from dotenv import load_dotenv
 
 load_dotenv()
 
-from data_manager import DataManager
+from data_manager import DataManager, create_data_manager
 from scrap import verify_letterboxd_user
 
+SEED_USERS = [
+    "martinscorsese",
+    "quentintarantino",
+    "wesanderson",
+    "tarab",
+    "steven_spielberg",
+    "paulthomasanderson",
+    "kathrynbigelow",
+    "davidfincher",
+    "emilymorgan",
+    "charlize_theron",
+    "robertdowneyjr",
+    "jamescameron",
+    "jenniferlawrence",
+    "ridleyscott",
+    "christophernolan"
+]
+
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
 }
@@ -85,6 +103,16 @@ def scrape_user_data(data_manager: DataManager, username: str, max_pages: int =
         print(f"Nenhum filme encontrado para {username}")
         return False
 
+    # Preferred path: one bulk insert for the whole profile
+    if hasattr(data_manager, "add_ratings_bulk"):
+        try:
+            added = data_manager.add_ratings_bulk(username, watched)
+        except Exception as e:
+            print(f"Erro ao inserir avaliações em lote para {username}: {e}", file=sys.stderr)
+            return False
+        print(f"Scraping concluído para {username}. Filmes processados: {len(watched)}. Avaliações inseridas: {added}")
+        return True
+
     inserted_any = False
 
     # Ensure user exists in data_manager
@@ -153,38 +181,40 @@ def scrape_user_data(data_manager: DataManager, username: str, max_pages: int =
     print(f"Scraping concluído para {username}. Filmes processados: {len(watched)}. Inserções efetivas: {inserted_any}")
     return inserted_any
 
-def populate_initial_data(usernames: Optional[List[str]] = None) -> dict:
+def populate_initial_data(usernames: Optional[List[str]] = None,
+                          data_manager: Optional[DataManager] = None,
+                          skip: Iterable[str] = (),
+                          on_user: Optional[Callable[[str, str, dict], None]] = None,
+                          should_stop: Optional[Callable[[], bool]] = None) -> dict:
     """
     Populate initial data using a set of Letterboxd profiles.
     Returns a summary dict with counts.
+
+    Users in skip are not processed again (e.g. when resuming). on_user(username,
+    outcome, summary) is called after each user with outcome "successful", "skipped"
+    or "error"; should_stop() is checked before each user to stop early.
     """
-    dm = DataManager()
-    seed_users = usernames or [
-        "martinscorsese",
-        "quentintarantino",
-        "wesanderson",
-        "tarab",
-        "steven_spielberg",
-        "paulthomasanderson",
-        "kathrynbigelow",
-        "davidfincher",
-        "emilymorgan",
-        "charlize_theron",
-        "robertdowneyjr",
-        "jamescameron",
-        "jenniferlawrence",
-        "ridleyscott",
-        "christophernolan"
-    ]
+    dm = data_manager or create_data_manager()
+    seed_users = usernames or SEED_USERS
+    skip = set(skip)
 
     summary = {"attempted": 0, "successful": 0, "skipped": 0, "errors": []}
 
     for u in seed_users:
+        if u in skip:
+            continue
+        if should_stop is not None and should_stop():
+            print("Populate interrompido")
+            summary["stopped"] = True
+            break
         summary["attempted"] += 1
+        outcome = "skipped"
         try:
             if not verify_letterboxd_user(u):
                 summary["skipped"] += 1
                 print(f"Usuário {u} não existe - pulando")
+                if on_user is not None:
+                    on_user(u, outcome, summary)
                 continue
 
             # Ensure user exists
@@ -201,12 +231,16 @@ def populate_initial_data(usernames: Optional[List[str]] = None) -> dict:
             added = scrape_user_data(dm, u)
             if added:
                 summary["successful"] += 1
+                outcome = "successful"
             else:
                 summary["skipped"] += 1
 
         except Exception as e:
             summary["errors"].append({"user": u, "error": str(e)})
+            outcome = "error"
             print(f"Erro ao popular dados para {u}: {e}", file=sys.stderr)
+        if on_user is not None:
+            on_user(u, outcome, summary)
         time.sleep(0.5)
 
     print("Populate concluído:", summary)
@@ -0,0 +1,76 @@
+"""
+Rate Limiter - Token buckets per client with bounded memory
+
+Each (route, client) pair has a bucket of `capacity` tokens refilled
+continuously at capacity/window tokens per second; a request spends one token.
+Only the token count and the last refill time are kept per key, so a check is
+O(1). Buckets are kept in least-recently-seen order: keys idle long enough to
+be full again are dropped from the front as requests come in (a missing
+bucket is the same as a full one), and the total number of keys is capped.
+
+Buckets are per process: each gunicorn worker enforces its limits on the
+requests it receives, so the limit seen by a client scales with the workers.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Tuple
+
+class TokenBucketLimiter:
+    """Token buckets for one limit (capacity tokens per window seconds)"""
+
+    def __init__(self, capacity: float, window: float, max_keys: int = 100000):
+        self.capacity = float(capacity)
+        self.window = float(window)
+        self.rate = self.capacity / self.window
+        self.max_keys = max_keys
+        # key -> [tokens, last refill], least recently seen first
+        self._buckets: "OrderedDict[Hashable, list]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, key: Hashable, cost: float = 1.0, now: Optional[float] = None) -> bool:
+        """Spend cost tokens from key's bucket; False if there are not enough"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.capacity, now]
+            else:
+                bucket[0] = min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+                self._buckets.move_to_end(key)
+            allowed = bucket[0] >= cost
+            if allowed:
+                bucket[0] -= cost
+            self._evict(now)
+            return allowed
+
+    def _evict(self, now: float):
+        """Drop buckets idle for a full window (they would be full anyway) and enforce max_keys"""
+        buckets = self._buckets
+        while buckets:
+            key, (_, last) = next(iter(buckets.items()))
+            if now - last < self.window and len(buckets) <= self.max_keys:
+                break
+            del buckets[key]
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+class RateLimiter:
+    """Named limits (e.g. one per route), each with its own token buckets per client"""
+
+    def __init__(self, limits: Dict[str, Tuple[float, float]], max_keys: int = 100000):
+        self.limits = {
+            name: TokenBucketLimiter(capacity, window, max_keys)
+            for name, (capacity, window) in limits.items()
+        }
+
+    def allow(self, name: str, key: Hashable) -> bool:
+        """Whether client key may call the route; routes without a limit are always allowed"""
+        limiter = self.limits.get(name)
+        return limiter is None or limiter.allow(key)
+
+    def stats(self) -> Dict[str, int]:
+        return {name: len(limiter) for name, limiter in self.limits.items()}
@@ -0,0 +1,664 @@
+"""
+Recommender - KMeans clustering model over the user-movie rating matrix
+
+The model (scaler, SVD components, centroids and user cluster labels) is fitted
+once per data version and saved under data/models, so a request only has to
+look up the user's cluster and score the candidate films. When the data moves
+on, the previous model keeps serving (new users are folded in by projecting
+them with the stored scaler/SVD) while a refit runs in the background.
+
+An item-item engine (top-N cosine neighbors per film) is stored and served
+the same way, as is an ALS matrix factorization engine. The user-kNN engine
+reuses the clustering model's SVD embeddings through a ball tree index.
+Every user's top-N can be precomputed after a build and stored the same way.
+"""
+
+import fcntl
+import json
+import os
+import logging
+import threading
+from typing import Callable, List, Optional, NamedTuple, Tuple, Type
+
+import numpy as np
+from scipy.sparse import csr_matrix, diags
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.preprocessing import StandardScaler
+from sklearn.decomposition import TruncatedSVD
+from sklearn.metrics import silhouette_score
+from sklearn.neighbors import NearestNeighbors
+
+from data_manager import RatingColumns
+from deadline import Deadline, DeadlineExceeded, check_deadline
+
+logger = logging.getLogger(__name__)
+
+# Automatic k selection
+MAX_CLUSTERS = 10
+SILHOUETTE_SAMPLE_SIZE = int(os.environ.get("SILHOUETTE_SAMPLE_SIZE", 2000))
+# Above this many users KMeans is replaced by MiniBatchKMeans
+MINIBATCH_USER_THRESHOLD = int(os.environ.get("MINIBATCH_USER_THRESHOLD", 5000))
+# The cached best k is re-chosen only when the user count moved by more than this fraction
+K_RECOMPUTE_FRACTION = float(os.environ.get("K_RECOMPUTE_FRACTION", 0.1))
+
+# Item-item engine: neighbors kept per film and films per similarity block
+ITEM_NEIGHBORS = int(os.environ.get("ITEM_NEIGHBORS", 50))
+ITEM_BLOCK_SIZE = 512
+
+# User-kNN engine: similar users whose ratings score the films
+USER_NEIGHBORS = int(os.environ.get("USER_NEIGHBORS", 30))
+
+# ALS engine (implicit feedback: confidence = 1 + ALS_ALPHA * rating)
+ALS_FACTORS = int(os.environ.get("ALS_FACTORS", 32))
+ALS_REGULARIZATION = float(os.environ.get("ALS_REGULARIZATION", 0.1))
+ALS_ITERATIONS = int(os.environ.get("ALS_ITERATIONS", 10))
+ALS_ALPHA = float(os.environ.get("ALS_ALPHA", 1.0))
+# Ratings per solve block (bounds the ratings x factors x factors temporary)
+ALS_BLOCK_RATINGS = 8192
+
+def _code_position(codes: np.ndarray, code: Optional[int]) -> Optional[int]:
+    """Position of a code in a sorted code array, or None if it is not there"""
+    if code is None:
+        return None
+    position = int(np.searchsorted(codes, code))
+    if position < len(codes) and codes[position] == code:
+        return position
+    return None
+
+class ClusterModel(NamedTuple):
+    """Fitted clustering model; row i of the matrix is user user_codes[i]"""
+    version: int
+    user_codes: np.ndarray  # user code of each matrix row
+    movie_codes: np.ndarray  # movie code of each matrix column
+    scaler_scale: np.ndarray  # per-movie scale; ratings are not centered (sparse input)
+    components: np.ndarray  # SVD components (n_components x n_movies), empty if not reduced
+    centroids: np.ndarray
+    labels: np.ndarray  # cluster of each row
+    best_k: int
+    embeddings: np.ndarray  # float32 reduced vector of each row
+
+    def user_row(self, user_code: Optional[int]) -> Optional[int]:
+        """Matrix row of a user, or None if the user had no ratings at fit time"""
+        return _code_position(self.user_codes, user_code)
+
+    def cluster_members(self, cluster: int) -> np.ndarray:
+        """User codes of every user in a cluster"""
+        return self.user_codes[self.labels == cluster]
+
+    def project(self, movie_codes: np.ndarray, ratings: np.ndarray) -> np.ndarray:
+        """
+        Embedding of a user the model was not fitted on, using the stored scale
+        and SVD components. Films unknown to the model are ignored.
+        """
+        x = np.zeros(len(self.movie_codes))
+        cols = np.searchsorted(self.movie_codes, movie_codes)
+        known = cols < len(self.movie_codes)
+        known[known] = self.movie_codes[cols[known]] == movie_codes[known]
+        x[cols[known]] = ratings[known]
+        x /= self.scaler_scale
+        return x @ self.components.T if len(self.components) else x
+
+    def fold_in(self, movie_codes: np.ndarray, ratings: np.ndarray) -> int:
+        """Cluster of a user the model was not fitted on: nearest centroid to their projection"""
+        z = self.project(movie_codes, ratings)
+        return int(np.argmin(((self.centroids - z) ** 2).sum(axis=1)))
+
+def film_scores(movie_idx: np.ndarray, ratings: np.ndarray, n_movies: int,
+                mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Score every film at once as mean * (1 + 0.1 * count) over the selected ratings.
+    Returns (scores, counts) indexed by movie code; films without ratings score 0.
+    """
+    if mask is not None:
+        movie_idx = movie_idx[mask]
+        ratings = ratings[mask]
+    counts = np.bincount(movie_idx, minlength=n_movies)
+    sums = np.bincount(movie_idx, weights=ratings, minlength=n_movies)
+    scores = np.zeros(n_movies)
+    rated = counts > 0
+    scores[rated] = sums[rated] / counts[rated] * (1 + 0.1 * counts[rated])
+    return scores, counts
+
+def top_k(candidates: np.ndarray, scores: np.ndarray, k: int) -> np.ndarray:
+    """Candidates with the k highest scores, best first (argpartition, then sort only k)"""
+    if len(candidates) > k:
+        keep = np.argpartition(-scores, k - 1)[:k]
+        candidates, scores = candidates[keep], scores[keep]
+    return candidates[np.argsort(-scores, kind='stable')]
+
+def top_k_rows(scores: np.ndarray, k: int) -> np.ndarray:
+    """Column indices of the k highest scores of every row, best first (n_rows x min(k, n_cols))"""
+    k = min(k, scores.shape[1])
+    if k == 0:
+        return np.zeros((scores.shape[0], 0), dtype=np.intp)
+    if scores.shape[1] > k:
+        keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        keep = np.tile(np.arange(k), (scores.shape[0], 1))
+    order = np.argsort(-np.take_along_axis(scores, keep, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(keep, order, axis=1)
+
+def _kmeans(n_clusters: int, n_users: int, n_init: int):
+    if n_users > MINIBATCH_USER_THRESHOLD:
+        return MiniBatchKMeans(n_clusters=n_clusters, random_state=42, n_init=3, batch_size=1024)
+    return KMeans(n_clusters=n_clusters, random_state=42, n_init=n_init)
+
+def choose_k(X_reduced: np.ndarray, deadline: Optional[Deadline] = None) -> int:
+    """Pick the number of clusters with the best (sampled) silhouette score"""
+    n_users = X_reduced.shape[0]
+    # silhouette needs 2 <= k <= n_samples - 1
+    max_clusters = min(MAX_CLUSTERS, n_users - 1)
+    if max_clusters < 2:
+        return max(1, min(2, n_users))
+
+    best_score = -1
+    best_k = 2
+    sample_size = min(SILHOUETTE_SAMPLE_SIZE, n_users)
+    for k in range(2, max_clusters + 1):
+        check_deadline(deadline, f"escolha de k (k={k})")
+        labels = _kmeans(k, n_users, n_init=10).fit_predict(X_reduced)
+        if len(set(labels)) > 1:
+            score = silhouette_score(X_reduced, labels, sample_size=sample_size, random_state=42)
+        else:
+            score = -1
+        if score > best_score:
+            best_score = score
+            best_k = k
+    return best_k
+
+def cached_k(X_reduced: np.ndarray, cache_path: Optional[str], deadline: Optional[Deadline] = None) -> int:
+    """
+    Reuse the best k stored in cache_path while the user count stays within
+    K_RECOMPUTE_FRACTION of the count it was chosen for; otherwise sweep again.
+    """
+    n_users = X_reduced.shape[0]
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path) as f:
+                cached = json.load(f)
+            drift = abs(n_users - cached['n_users']) / max(cached['n_users'], 1)
+            if drift <= K_RECOMPUTE_FRACTION and 1 <= cached['best_k'] <= max(1, n_users - 1):
+                logger.debug(f"Reutilizando k={cached['best_k']} (variação de usuários {drift:.1%})")
+                return cached['best_k']
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Cache de k inválido: {e}")
+
+    best_k = choose_k(X_reduced, deadline)
+    if cache_path:
+        tmp_path = f"{cache_path}.tmp{os.getpid()}"
+        with open(tmp_path, 'w') as f:
+            json.dump({'best_k': best_k, 'n_users': n_users}, f)
+        os.replace(tmp_path, cache_path)
+    return best_k
+
+def build_model(columns: RatingColumns, k_cache_path: Optional[str] = None,
+                deadline: Optional[Deadline] = None) -> ClusterModel:
+    """
+    Fit scaler, SVD and KMeans on the full rating matrix of one data version.
+    The deadline, if any, is checked between stages (DeadlineExceeded).
+    """
+    logger.info(f"Treinando modelo de clusters para a versão {columns.version}")
+
+    # Criar matriz esparsa usuário-filme (apenas usuários/filmes com avaliações)
+    user_idx = np.asarray(columns.user_idx)
+    movie_idx = np.asarray(columns.movie_idx)
+    usuarios, linhas = np.unique(user_idx, return_inverse=True)
+    filmes, colunas = np.unique(movie_idx, return_inverse=True)
+    rating_matrix = csr_matrix(
+        (np.asarray(columns.rating, dtype=np.float64), (linhas, colunas)),
+        shape=(len(usuarios), len(filmes))
+    )
+
+    # Pré-processamento e redução de dimensionalidade; sem centralizar para manter a matriz esparsa
+    check_deadline(deadline, "matriz")
+    scaler = StandardScaler(with_mean=False)
+    X_scaled = scaler.fit_transform(rating_matrix)
+
+    n_components = min(30, X_scaled.shape[1] - 1)
+    if n_components > 0:
+        svd = TruncatedSVD(n_components=n_components, random_state=42)
+        X_reduced = svd.fit_transform(X_scaled)
+        components = svd.components_
+    else:
+        X_reduced = X_scaled.toarray()
+        components = np.zeros((0, X_scaled.shape[1]))
+
+    # Definir clusters automaticamente (k em cache enquanto a base não mudar muito)
+    check_deadline(deadline, "SVD")
+    best_k = cached_k(X_reduced, k_cache_path, deadline)
+    logger.info(f"Melhor número de clusters: {best_k}")
+
+    check_deadline(deadline, "clusterização")
+    kmeans = _kmeans(best_k, X_reduced.shape[0], n_init=20)
+    clusters = kmeans.fit_predict(X_reduced)
+
+    return ClusterModel(
+        version=columns.version,
+        user_codes=usuarios.astype(np.int32),
+        movie_codes=filmes.astype(np.int32),
+        scaler_scale=scaler.scale_,
+        components=components,
+        centroids=kmeans.cluster_centers_,
+        labels=clusters.astype(np.int32),
+        best_k=best_k,
+        embeddings=X_reduced.astype(np.float32)
+    )
+
+class UserNeighborIndex:
+    """Ball tree over a clustering model's user embeddings, rebuilt when the model changes"""
+
+    def __init__(self):
+        self._version = None
+        self._index = None
+        self._lock = threading.Lock()
+
+    def _get_index(self, model: ClusterModel) -> NearestNeighbors:
+        with self._lock:
+            if self._version != model.version:
+                logger.debug(f"Construindo índice de vizinhos para o modelo v{model.version}")
+                self._index = NearestNeighbors(algorithm='ball_tree').fit(model.embeddings)
+                self._version = model.version
+            return self._index
+
+    def query(self, model: ClusterModel, embedding: np.ndarray, k: int = USER_NEIGHBORS,
+              exclude: Optional[int] = None) -> np.ndarray:
+        """User codes of the k users nearest to an embedding, nearest first"""
+        index = self._get_index(model)
+        n_neighbors = min(k + (exclude is not None), len(model.user_codes))
+        _, rows = index.kneighbors(np.asarray(embedding, dtype=np.float32)[None, :], n_neighbors=n_neighbors)
+        codes = model.user_codes[rows[0]]
+        if exclude is not None:
+            codes = codes[codes != exclude]
+        return codes[:k]
+
+class ItemNeighbors(NamedTuple):
+    """Top-N most similar films (cosine over user ratings) for every movie code"""
+    version: int
+    neighbors: np.ndarray  # int32 (n_movies x N), movie codes, -1 where there is no neighbor
+    similarities: np.ndarray  # float32 (n_movies x N), best first
+
+    def recommend(self, movie_codes: np.ndarray, ratings: np.ndarray,
+                  k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Score films by summing their similarity to each film the user rated, weighted
+        by that rating. Costs O(user ratings x N). Returns (codes, scores) best first,
+        excluding the films the user already rated.
+        """
+        known = movie_codes < len(self.neighbors)
+        neighbors = self.neighbors[movie_codes[known]]
+        weights = self.similarities[movie_codes[known]] * ratings[known][:, None]
+        valid = neighbors >= 0
+        candidates, inverse = np.unique(neighbors[valid], return_inverse=True)
+        scores = np.bincount(inverse, weights=weights[valid], minlength=len(candidates))
+        unseen = ~np.isin(candidates, movie_codes)
+        candidates, scores = candidates[unseen], scores[unseen]
+        order = top_k(np.arange(len(candidates)), scores, k)
+        return candidates[order], scores[order]
+
+def build_item_neighbors(columns: RatingColumns, n_neighbors: int = ITEM_NEIGHBORS,
+                         deadline: Optional[Deadline] = None) -> ItemNeighbors:
+    """Cosine similarity between film columns, keeping only the top-N per film"""
+    logger.info(f"Calculando vizinhos item-item para a versão {columns.version}")
+    n_users, n_movies = len(columns.usernames), len(columns.titles)
+    matrix = csr_matrix(
+        (np.asarray(columns.rating, dtype=np.float64),
+         (np.asarray(columns.user_idx), np.asarray(columns.movie_idx))),
+        shape=(n_users, n_movies)
+    )
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel())
+    inverse_norms = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    normalized = (matrix @ diags(inverse_norms)).tocsc()
+    normalized_t = normalized.T.tocsr()
+
+    n = max(0, min(n_neighbors, n_movies - 1))
+    neighbors = np.full((n_movies, n), -1, dtype=np.int32)
+    similarities = np.zeros((n_movies, n), dtype=np.float32)
+    if n == 0:
+        return ItemNeighbors(columns.version, neighbors, similarities)
+
+    # Dense similarity one block of films at a time to bound memory at block x n_movies
+    for start in range(0, n_movies, ITEM_BLOCK_SIZE):
+        check_deadline(deadline, "similaridade item-item")
+        stop = min(start + ITEM_BLOCK_SIZE, n_movies)
+        block = (normalized_t[start:stop] @ normalized).toarray()
+        block[np.arange(stop - start), np.arange(start, stop)] = 0
+        top = np.argpartition(-block, n - 1, axis=1)[:, :n]
+        values = np.take_along_axis(block, top, axis=1)
+        order = np.argsort(-values, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        values = np.take_along_axis(values, order, axis=1)
+        top[values <= 0] = -1
+        values[values <= 0] = 0
+        neighbors[start:stop] = top
+        similarities[start:stop] = values
+
+    return ItemNeighbors(columns.version, neighbors, similarities)
+
+class ALSModel(NamedTuple):
+    """Implicit-feedback ALS factors; row i of user_factors is user user_codes[i]"""
+    version: int
+    user_codes: np.ndarray
+    movie_codes: np.ndarray  # movie code of each item_factors row
+    user_factors: np.ndarray  # float32 (n_users x factors)
+    item_factors: np.ndarray  # float32 (n_movies x factors)
+
+    def fold_in(self, movie_codes: np.ndarray, ratings: np.ndarray) -> np.ndarray:
+        """Factors of a user the model was not fitted on: one least-squares half step"""
+        cols = np.searchsorted(self.movie_codes, movie_codes)
+        known = cols < len(self.movie_codes)
+        known[known] = self.movie_codes[cols[known]] == movie_codes[known]
+        indptr = np.array([0, known.sum()])
+        return _als_solve(indptr, cols[known], 1 + ALS_ALPHA * ratings[known],
+                          self.item_factors.astype(np.float64), ALS_REGULARIZATION)[0]
+
+    def recommend(self, user_code: Optional[int], movie_codes: np.ndarray, ratings: np.ndarray,
+                  k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k unseen films for a user as one dot product against the item factors.
+        Returns (codes, scores) best first; empty if the user has nothing to go on.
+        """
+        row = _code_position(self.user_codes, user_code)
+        if row is not None:
+            factors = self.user_factors[row]
+        elif np.isin(movie_codes, self.movie_codes).any():
+            factors = self.fold_in(movie_codes, ratings)
+        else:
+            return np.zeros(0, dtype=np.int32), np.zeros(0)
+        scores = self.item_factors @ factors.astype(np.float32)
+        unseen = ~np.isin(self.movie_codes, movie_codes)
+        candidates = np.flatnonzero(unseen)
+        order = top_k(candidates, scores[candidates], k)
+        return self.movie_codes[order], scores[order].astype(np.float64)
+
+    def recommend_many(self, users: List[Tuple[Optional[int], np.ndarray, np.ndarray]],
+                       k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        recommend() for several (user_code, movie_codes, ratings) at once: users the
+        model was not fitted on are folded in first, then every user is scored with
+        one matrix product against the item factors.
+        """
+        codes = np.array([-1 if code is None else code for code, _, _ in users], dtype=np.int64)
+        rows = np.searchsorted(self.user_codes, codes)
+        fitted = rows < len(self.user_codes)
+        fitted[fitted] = self.user_codes[rows[fitted]] == codes[fitted]
+        factors = np.zeros((len(users), self.item_factors.shape[1]), dtype=np.float32)
+        factors[fitted] = self.user_factors[rows[fitted]]
+        usable = fitted.copy()
+        for i in np.flatnonzero(~fitted):
+            _, movie_codes, ratings = users[i]
+            if np.isin(movie_codes, self.movie_codes).any():
+                factors[i] = self.fold_in(movie_codes, ratings)
+                usable[i] = True
+
+        scores = factors @ self.item_factors.T
+        scores[~usable] = -np.inf
+        # Films each user has already rated are not recommended
+        seen_rows = np.repeat(np.arange(len(users)), [len(movie_codes) for _, movie_codes, _ in users])
+        seen_codes = np.concatenate([movie_codes for _, movie_codes, _ in users] + [np.zeros(0, dtype=np.int32)])
+        seen_cols = np.searchsorted(self.movie_codes, seen_codes)
+        rated = seen_cols < len(self.movie_codes)
+        rated[rated] = self.movie_codes[seen_cols[rated]] == seen_codes[rated]
+        scores[seen_rows[rated], seen_cols[rated]] = -np.inf
+
+        results = []
+        for i, cols in enumerate(top_k_rows(scores, k)):
+            cols = cols[np.isfinite(scores[i, cols])]
+            results.append((self.movie_codes[cols], scores[i, cols].astype(np.float64)))
+        return results
+
+def _als_solve(indptr: np.ndarray, indices: np.ndarray, confidence: np.ndarray,
+               Y: np.ndarray, regularization: float) -> np.ndarray:
+    """
+    One ALS half step: for every row u solve
+    (YtY + Yt(C_u - I)Y + reg*I) x_u = Yt C_u p_u, with p_u = 1 on the rated columns.
+    Rows are solved in blocks of about ALS_BLOCK_RATINGS ratings; every row must have ratings.
+    """
+    n_rows, n_factors = len(indptr) - 1, Y.shape[1]
+    base = Y.T @ Y + regularization * np.eye(n_factors)
+    X = np.zeros((n_rows, n_factors))
+    start = 0
+    while start < n_rows:
+        stop = int(np.searchsorted(indptr, indptr[start] + ALS_BLOCK_RATINGS, side='right')) - 1
+        stop = min(max(stop, start + 1), n_rows)
+        lo, hi = indptr[start], indptr[stop]
+        W = Y[indices[lo:hi]]
+        conf = confidence[lo:hi]
+        offsets = indptr[start:stop] - lo
+        A = base + np.add.reduceat(np.einsum('nf,ng->nfg', W * (conf - 1)[:, None], W), offsets)
+        b = np.add.reduceat(W * conf[:, None], offsets)
+        X[start:stop] = np.linalg.solve(A, b[:, :, None])[:, :, 0]
+        start = stop
+    return X
+
+def build_als(columns: RatingColumns, deadline: Optional[Deadline] = None) -> ALSModel:
+    """Alternating least squares on the sparse rating matrix (users/films with ratings only)"""
+    logger.info(f"Treinando ALS para a versão {columns.version}")
+    usuarios, linhas = np.unique(np.asarray(columns.user_idx), return_inverse=True)
+    filmes, colunas = np.unique(np.asarray(columns.movie_idx), return_inverse=True)
+    confidence = 1 + ALS_ALPHA * np.asarray(columns.rating, dtype=np.float64)
+    by_user = csr_matrix((confidence, (linhas, colunas)), shape=(len(usuarios), len(filmes)))
+    by_movie = by_user.T.tocsr()
+
+    rng = np.random.default_rng(42)
+    Y = rng.normal(scale=0.01, size=(len(filmes), ALS_FACTORS))
+    X = np.zeros((len(usuarios), ALS_FACTORS))
+    for iteration in range(ALS_ITERATIONS):
+        check_deadline(deadline, f"ALS (iteração {iteration + 1})")
+        X = _als_solve(by_user.indptr, by_user.indices, by_user.data, Y, ALS_REGULARIZATION)
+        Y = _als_solve(by_movie.indptr, by_movie.indices, by_movie.data, X, ALS_REGULARIZATION)
+
+    return ALSModel(
+        version=columns.version,
+        user_codes=usuarios.astype(np.int32),
+        movie_codes=filmes.astype(np.int32),
+        user_factors=X.astype(np.float32),
+        item_factors=Y.astype(np.float32)
+    )
+
+class TopN(NamedTuple):
+    """Precomputed recommendations of one data version; row i belongs to user code i"""
+    version: int
+    movies: np.ndarray  # int32 (n_users x N), best first, -1 pads
+    scores: np.ndarray  # float32 (n_users x N)
+
+    def lookup(self, user_code: Optional[int]) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """(codes, scores) of a user, or None if the user was not there at build time"""
+        if user_code is None or user_code >= len(self.movies):
+            return None
+        valid = self.movies[user_code] >= 0
+        if not valid.any():
+            return None
+        return self.movies[user_code][valid], self.scores[user_code][valid]
+
+def save_model(model: NamedTuple, path: str):
+    """Save a model as .npz (written to a temp file, then renamed into place)"""
+    tmp_path = f"{path}.tmp{os.getpid()}.{threading.get_ident()}.npz"
+    np.savez(tmp_path, **{
+        field: np.asarray(value) for field, value in model._asdict().items()
+    })
+    os.replace(tmp_path, path)
+
+def load_model(path: str, model_cls: Type = ClusterModel):
+    with np.load(path) as data:
+        fields = {field: data[field] for field in model_cls._fields}
+    for field, annotation in model_cls.__annotations__.items():
+        if annotation is int:
+            fields[field] = int(fields[field])
+    return model_cls(**fields)
+
+class Recommender:
+    """
+    Keeps the model of the current data version, fitting it at most once per version.
+    A model for an older version keeps serving while the new one is fitted in the background.
+    The same store serves every engine: kind names the files, builder(columns, deadline=None)
+    fits a model.
+    """
+
+    def __init__(self, model_dir: str, kind: str = "cluster",
+                 builder: Optional[Callable[..., NamedTuple]] = None,
+                 model_cls: Type = ClusterModel):
+        self.model_dir = model_dir
+        self.kind = kind
+        self.model_cls = model_cls
+        self.builder = builder or (
+            lambda columns, deadline=None: build_model(columns, os.path.join(model_dir, "kselect.json"), deadline)
+        )
+        os.makedirs(model_dir, exist_ok=True)
+        self._model = None
+        self._lock = threading.Lock()
+        self._rebuilding = False
+        # Called in the background with the columns after every build (e.g. precomputing results)
+        self.on_build = []
+
+    def _model_path(self, version: int) -> str:
+        return os.path.join(self.model_dir, f"{self.kind}_v{version}.npz")
+
+    def _saved_versions(self):
+        prefix = f"{self.kind}_v"
+        for name in os.listdir(self.model_dir):
+            if name.startswith(prefix) and name.endswith(".npz") and '.tmp' not in name:
+                try:
+                    yield int(name[len(prefix):-len(".npz")])
+                except ValueError:
+                    continue
+
+    def _load(self, version: int):
+        path = self._model_path(version)
+        logger.debug(f"Carregando modelo salvo {path}")
+        try:
+            return load_model(path, self.model_cls)
+        except (KeyError, ValueError, OSError) as e:
+            # Unreadable or written by an older layout: it will be refitted
+            logger.warning(f"Modelo salvo inválido ({e}), treinando novamente")
+            return None
+
+    def get_saved(self, version: int):
+        """Newest model for a data version up to version (memory, then disk), without fitting"""
+        model = self._model
+        if model is not None and model.version == version:
+            return model
+
+        # Newest model on disk, possibly saved by another worker
+        saved = [v for v in self._saved_versions() if v <= version]
+        newest = max(saved, default=None)
+        if newest is not None and (model is None or newest > model.version):
+            loaded = self._load(newest)
+            if loaded is not None:
+                model = self._model = loaded
+        return model
+
+    def get_model(self, columns: RatingColumns, deadline: Optional[Deadline] = None):
+        """
+        Return the model for the columns' version (memory, then disk). If it does not
+        exist yet, return the newest older model and refit in the background; fit
+        inline only when there is no model at all. If the deadline runs out during
+        that inline fit, the fit moves to the background and DeadlineExceeded is raised;
+        it is also raised right away while that background fit (here or in another
+        process) is still running, rather than starting a competing fit.
+        """
+        model = self.get_saved(columns.version)
+        if model is not None and model.version == columns.version:
+            return model
+
+        if model is None:
+            if self._building():
+                raise DeadlineExceeded(f"Modelo {self.kind} ainda em treinamento")
+            try:
+                return self.build(columns, deadline)
+            except DeadlineExceeded:
+                self._schedule_rebuild(columns)
+                raise
+
+        logger.info(f"Usando modelo {self.kind} v{model.version} enquanto a versão {columns.version} é treinada")
+        self._schedule_rebuild(columns)
+        return model
+
+    def build(self, columns: RatingColumns, deadline: Optional[Deadline] = None):
+        """Fit, save and publish the model for the columns' version"""
+        model = self.builder(columns, deadline=deadline)
+        path = self._model_path(columns.version)
+        save_model(model, path)
+        self._remove_old_models(columns.version)
+        with self._lock:
+            if self._model is None or self._model.version < model.version:
+                self._model = model
+        for callback in self.on_build:
+            threading.Thread(target=self._run_callback, args=(callback, columns),
+                             name=f"{self.kind}-on-build", daemon=True).start()
+        return model
+
+    def _run_callback(self, callback: Callable[[RatingColumns], object], columns: RatingColumns):
+        try:
+            callback(columns)
+        except Exception as e:
+            logger.error(f"Erro após treinar modelo {self.kind}: {str(e)}")
+
+    def _schedule_rebuild(self, columns: RatingColumns):
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._rebuild, args=(columns,), name="model-rebuild", daemon=True).start()
+
+    def _build_lock_path(self) -> str:
+        return os.path.join(self.model_dir, f".build_{self.kind}.lock")
+
+    def _building(self) -> bool:
+        """Whether a background fit is running in this process or holds the build lock in another"""
+        if self._rebuilding:
+            return True
+        with open(self._build_lock_path(), 'a') as handle:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            fcntl.flock(handle, fcntl.LOCK_UN)
+        return False
+
+    def _rebuild(self, columns: RatingColumns):
+        try:
+            # Only one process refits at a time; the others pick the result up from disk
+            with open(self._build_lock_path(), 'a') as handle:
+                try:
+                    fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    logger.debug("Outro processo já está treinando o modelo")
+                    return
+                # The columns may be stale by now: another process could have saved
+                # this version or a newer one while the rebuild was queued
+                if max(self._saved_versions(), default=-1) < columns.version:
+                    self.build(columns)
+        except Exception as e:
+            logger.error(f"Erro ao treinar modelo em segundo plano: {str(e)}")
+        finally:
+            with self._lock:
+                self._rebuilding = False
+
+    def _remove_old_models(self, current_version: int):
+        """Remove models older than current_version (never newer ones saved meanwhile)"""
+        for version in list(self._saved_versions()):
+            if version < current_version:
+                try:
+                    os.remove(self._model_path(version))
+                except OSError:
+                    pass
+
+def main():
+    """Fit and save the model for the current data (e.g. after populate_data.py)"""
+    from data_manager import create_data_manager
+
+    logging.basicConfig(level=logging.INFO)
+    data_manager = create_data_manager()
+    columns = data_manager.get_ratings_columns()
+    model = Recommender(data_manager.model_dir).build(columns)
+    print(f"Modelo v{model.version}: {len(model.user_codes)} usuários, "
+          f"{len(model.movie_codes)} filmes, {model.best_k} clusters")
+    items = Recommender(data_manager.model_dir, "item",
+                        build_item_neighbors, ItemNeighbors).build(columns)
+    print(f"Vizinhos item-item v{items.version}: {items.neighbors.shape[1]} por filme")
+    als = Recommender(data_manager.model_dir, "als",
+                      build_als, ALSModel).build(columns)
+    print(f"ALS v{als.version}: {als.user_factors.shape[1]} fatores")
+
+if __name__ == "__main__":
+    main()
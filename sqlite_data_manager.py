@@ -0,0 +1,312 @@
+"""
+SQLite Data Manager - Same interface as DataManager, backed by a single SQLite file
+
+Selected with DATA_BACKEND=sqlite. Uses WAL mode so readers never block the
+writer and several worker processes can share the database safely.
+"""
+
+import math
+import os
+import sqlite3
+import threading
+from functools import partial
+from typing import List, Dict, Tuple, Optional
+import logging
+
+import numpy as np
+
+from data_manager import (
+    POPULAR_MIN_VOTES, RatingColumns, write_columnar_snapshot, open_columnar_snapshot
+)
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    username TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username ON users (username);
+
+CREATE TABLE IF NOT EXISTS movies (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_movies_title ON movies (title);
+
+CREATE TABLE IF NOT EXISTS ratings (
+    user_id INTEGER NOT NULL REFERENCES users (id),
+    movie_id INTEGER NOT NULL REFERENCES movies (id),
+    rating REAL NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_ratings_user_movie ON ratings (user_id, movie_id);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0);
+
+-- Row counters for get_stats, kept current by triggers instead of COUNT(*) scans
+INSERT OR IGNORE INTO meta (key, value) SELECT 'total_users', COUNT(*) FROM users;
+INSERT OR IGNORE INTO meta (key, value) SELECT 'total_movies', COUNT(*) FROM movies;
+INSERT OR IGNORE INTO meta (key, value) SELECT 'total_ratings', COUNT(*) FROM ratings;
+CREATE TRIGGER IF NOT EXISTS trg_users_count AFTER INSERT ON users
+BEGIN UPDATE meta SET value = value + 1 WHERE key = 'total_users'; END;
+CREATE TRIGGER IF NOT EXISTS trg_movies_count AFTER INSERT ON movies
+BEGIN UPDATE meta SET value = value + 1 WHERE key = 'total_movies'; END;
+CREATE TRIGGER IF NOT EXISTS trg_ratings_count AFTER INSERT ON ratings
+BEGIN UPDATE meta SET value = value + 1 WHERE key = 'total_ratings'; END;
+
+-- Running per-movie aggregates for get_popular_movies
+CREATE TABLE IF NOT EXISTS movie_stats (
+    movie_id INTEGER PRIMARY KEY REFERENCES movies (id),
+    rating_sum REAL NOT NULL,
+    rating_count INTEGER NOT NULL,
+    rating_sumsq REAL NOT NULL
+);
+INSERT INTO movie_stats (movie_id, rating_sum, rating_count, rating_sumsq)
+SELECT movie_id, SUM(rating), COUNT(*), SUM(rating * rating) FROM ratings
+WHERE NOT EXISTS (SELECT 1 FROM movie_stats)
+GROUP BY movie_id;
+CREATE TRIGGER IF NOT EXISTS trg_movie_stats_insert AFTER INSERT ON ratings
+BEGIN
+    INSERT INTO movie_stats (movie_id, rating_sum, rating_count, rating_sumsq)
+    VALUES (NEW.movie_id, NEW.rating, 1, NEW.rating * NEW.rating)
+    ON CONFLICT (movie_id) DO UPDATE SET
+        rating_sum = rating_sum + excluded.rating_sum,
+        rating_count = rating_count + 1,
+        rating_sumsq = rating_sumsq + excluded.rating_sumsq;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_movie_stats_update AFTER UPDATE OF rating ON ratings
+BEGIN
+    UPDATE movie_stats SET
+        rating_sum = rating_sum - OLD.rating + NEW.rating,
+        rating_sumsq = rating_sumsq - OLD.rating * OLD.rating + NEW.rating * NEW.rating
+    WHERE movie_id = NEW.movie_id;
+END;
+"""
+
+UPSERT_RATING = """
+INSERT INTO ratings (user_id, movie_id, rating) VALUES (?, ?, ?)
+ON CONFLICT (user_id, movie_id) DO UPDATE SET rating = excluded.rating
+"""
+
+BUMP_VERSION = "UPDATE meta SET value = value + 1 WHERE key = 'version'"
+
+class SQLiteDataManager:
+    def __init__(self, data_dir="data"):
+        self.data_dir = data_dir
+        self.db_file = os.path.join(data_dir, "letterboxd.db")
+        self.columnar_dir = os.path.join(data_dir, "columnar_sqlite")
+        # meta.version is unrelated to the JSON journal seq, so models are kept apart too
+        self.model_dir = os.path.join(data_dir, "models_sqlite")
+
+        # Create data directory if it doesn't exist
+        os.makedirs(data_dir, exist_ok=True)
+
+        # One connection per thread (and per process after a gunicorn fork)
+        self._local = threading.local()
+        self._columns: Optional[RatingColumns] = None
+        self._columns_lock = threading.Lock()
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_file, timeout=30, cached_statements=64)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _version(self, conn: sqlite3.Connection) -> int:
+        return conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+    def get_user_id(self, username: str) -> Optional[int]:
+        """Get user ID by username"""
+        row = self._connection().execute(
+            "SELECT id FROM users WHERE username = ?", (username,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def add_user(self, username: str) -> int:
+        """Add user and return user ID"""
+        with self._connection() as conn:
+            cursor = conn.execute("INSERT OR IGNORE INTO users (username) VALUES (?)", (username,))
+            if cursor.rowcount:
+                conn.execute(BUMP_VERSION)
+                return cursor.lastrowid
+            return conn.execute("SELECT id FROM users WHERE username = ?", (username,)).fetchone()[0]
+
+    def get_movie_id(self, title: str) -> Optional[int]:
+        """Get movie ID by title"""
+        row = self._connection().execute(
+            "SELECT id FROM movies WHERE title = ?", (title,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def add_movie(self, title: str) -> int:
+        """Add movie and return movie ID"""
+        with self._connection() as conn:
+            cursor = conn.execute("INSERT OR IGNORE INTO movies (title) VALUES (?)", (title,))
+            if cursor.rowcount:
+                conn.execute(BUMP_VERSION)
+                return cursor.lastrowid
+            return conn.execute("SELECT id FROM movies WHERE title = ?", (title,)).fetchone()[0]
+
+    def add_rating(self, user_id: int, movie_id: int, rating: float):
+        """Add rating (or update it if it already exists)"""
+        with self._connection() as conn:
+            conn.execute(UPSERT_RATING, (user_id, movie_id, rating))
+            conn.execute(BUMP_VERSION)
+
+    def add_ratings_bulk(self, username: str, ratings: List[Tuple[str, Optional[float]]]) -> int:
+        """
+        Add a user's (title, rating) pairs in one transaction.
+        Missing user/movies are created; pairs with a None rating only register the movie.
+        Returns the number of ratings upserted.
+        """
+        with self._connection() as conn:
+            conn.execute("INSERT OR IGNORE INTO users (username) VALUES (?)", (username,))
+            user_id = conn.execute("SELECT id FROM users WHERE username = ?", (username,)).fetchone()[0]
+
+            titles = list(dict.fromkeys(title for title, _ in ratings))
+            conn.executemany("INSERT OR IGNORE INTO movies (title) VALUES (?)", ((title,) for title in titles))
+            movie_ids = {}
+            # Resolve ids in chunks to stay under SQLite's bound-parameter limit
+            for start in range(0, len(titles), 500):
+                chunk = titles[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                movie_ids.update(conn.execute(
+                    f"SELECT title, id FROM movies WHERE title IN ({placeholders})", chunk
+                ).fetchall())
+
+            rated = {movie_ids[title]: rating for title, rating in ratings if rating is not None}
+            conn.executemany(UPSERT_RATING, ((user_id, movie_id, rating) for movie_id, rating in rated.items()))
+            conn.execute(BUMP_VERSION)
+        return len(rated)
+
+    def get_user_ratings(self, username: str) -> List[Tuple[str, float]]:
+        """Get user ratings as list of (title, rating) tuples"""
+        return self._connection().execute(
+            """
+            SELECT m.title, r.rating FROM ratings r
+            JOIN users u ON u.id = r.user_id
+            JOIN movies m ON m.id = r.movie_id
+            WHERE u.username = ?
+            """,
+            (username,),
+        ).fetchall()
+
+    def get_all_ratings(self) -> List[Tuple[str, str, float]]:
+        """Get all ratings as list of (username, title, rating) tuples"""
+        return self._connection().execute(
+            """
+            SELECT u.username, m.title, r.rating FROM ratings r
+            JOIN users u ON u.id = r.user_id
+            JOIN movies m ON m.id = r.movie_id
+            """
+        ).fetchall()
+
+    def get_ratings_columns(self) -> RatingColumns:
+        """Get all ratings as memory-mapped int32/float32 columns plus string tables"""
+        conn = self._connection()
+        # One builder per process: threads would otherwise share (and rmtree) the same .tmp<pid> dir
+        with self._columns_lock:
+            version = self._version(conn)
+            if self._columns is not None and self._columns.version == version:
+                return self._columns
+            self._columns = open_columnar_snapshot(self.columnar_dir, version, partial(self._write_columns, conn))
+            return self._columns
+
+    def _write_columns(self, conn: sqlite3.Connection) -> int:
+        """Write the columnar snapshot of the current data; returns the version written"""
+        # Read everything in one transaction so the tables match the version
+        with conn:
+            conn.execute("BEGIN")
+            version = self._version(conn)
+            users = conn.execute("SELECT id, username FROM users ORDER BY id").fetchall()
+            movies = conn.execute("SELECT id, title FROM movies ORDER BY id").fetchall()
+            rows = conn.execute("SELECT user_id, movie_id, rating FROM ratings").fetchall()
+        logger.info(f"Building columnar ratings snapshot v{version}")
+        user_ids = np.array([row[0] for row in users], dtype=np.int64)
+        movie_ids = np.array([row[0] for row in movies], dtype=np.int64)
+        ratings = np.array(rows, dtype=np.float64).reshape(-1, 3)
+        write_columnar_snapshot(
+            self.columnar_dir, version,
+            user_idx=np.searchsorted(user_ids, ratings[:, 0].astype(np.int64)),
+            movie_idx=np.searchsorted(movie_ids, ratings[:, 1].astype(np.int64)),
+            rating=ratings[:, 2],
+            usernames=[row[1] for row in users],
+            titles=[row[1] for row in movies],
+        )
+        return version
+
+    def get_popular_movies(self, limit: int = 10, min_votes: int = POPULAR_MIN_VOTES,
+                           mode: str = 'mean', prior_votes: Optional[float] = None) -> List[Tuple[str, float]]:
+        """
+        Get popular movies as list of (title, score) tuples from the movie_stats aggregates.
+        mode='mean' ranks by average rating; mode='bayesian' shrinks each average towards
+        the global mean with weight prior_votes (default: average ratings per movie).
+        """
+        conn = self._connection()
+        if mode == 'bayesian':
+            total, count, n_movies = conn.execute(
+                "SELECT SUM(rating_sum), SUM(rating_count), COUNT(*) FROM movie_stats"
+            ).fetchone()
+            global_mean = total / count if count else 0.0
+            prior = prior_votes if prior_votes is not None else (count or 0) / (n_movies or 1)
+            score_sql = "(? * ? + s.rating_sum) / (? + s.rating_count)"
+            params = (prior, global_mean, prior, min_votes, limit)
+        else:
+            score_sql = "s.rating_sum / s.rating_count"
+            params = (min_votes, limit)
+        return conn.execute(
+            f"""
+            SELECT m.title, {score_sql} AS score FROM movie_stats s
+            JOIN movies m ON m.id = s.movie_id
+            WHERE s.rating_count >= ? AND s.rating_count > 0
+            ORDER BY score DESC
+            LIMIT ?
+            """,
+            params,
+        ).fetchall()
+
+    def get_movie_stats(self, title: str) -> Optional[Dict]:
+        """Get count, mean and standard deviation of a movie's ratings"""
+        row = self._connection().execute(
+            """
+            SELECT s.rating_sum, s.rating_count, s.rating_sumsq FROM movie_stats s
+            JOIN movies m ON m.id = s.movie_id
+            WHERE m.title = ?
+            """,
+            (title,),
+        ).fetchone()
+        if not row or row[1] <= 0:
+            return None
+        total, count, total_sq = row
+        mean = total / count
+        return {
+            'count': count,
+            'mean': mean,
+            'std': math.sqrt(max(total_sq / count - mean * mean, 0.0))
+        }
+
+    def user_exists(self, username: str) -> bool:
+        """Check if user exists"""
+        return self.get_user_id(username) is not None
+
+    def get_stats(self) -> Dict:
+        """Get database statistics from the trigger-maintained counters"""
+        counters = dict(self._connection().execute(
+            "SELECT key, value FROM meta WHERE key IN ('total_users', 'total_movies', 'total_ratings')"
+        ).fetchall())
+        return {
+            'total_users': counters.get('total_users', 0),
+            'total_movies': counters.get('total_movies', 0),
+            'total_ratings': counters.get('total_ratings', 0)
+        }
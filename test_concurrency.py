@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Script de teste de concorrência do armazenamento (vários workers no mesmo data dir)
+
+Vários processos gravam avaliações ao mesmo tempo e leem o snapshot colunar a
+cada escrita, como workers do gunicorn. No fim confere que nenhuma escrita se
+perdeu, que o journal é reaplicado por um processo novo e que a compactação
+preserva os dados. Também simula um worker morto no meio de uma escrita no
+journal. Roda sem servidor: python test_concurrency.py
+"""
+
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+
+from data_manager import DataManager
+from sqlite_data_manager import SQLiteDataManager
+
+PROCESSES = 4
+USERS_PER_PROCESS = 25
+RATINGS_PER_USER = 5
+MOVIES = 40
+
+def expected_ratings(process: int, n: int):
+    return [
+        (f"Filme {(process * 7 + n + k) % MOVIES}", float((n + k) % 5 + 1))
+        for k in range(RATINGS_PER_USER)
+    ]
+
+def writer(manager_cls, data_dir: str, process: int, errors):
+    """Grava usuários e lê o snapshot colunar (em várias threads) após cada escrita"""
+    try:
+        if manager_cls is DataManager:
+            # Limiar baixo para compactar várias vezes durante o teste
+            manager = DataManager(data_dir, compact_threshold=30)
+        else:
+            manager = manager_cls(data_dir)
+
+        def read():
+            try:
+                columns = manager.get_ratings_columns()
+                if len(columns.rating) and float(columns.rating.max()) > 5:
+                    errors.put(f"{manager_cls.__name__}[{process}]: nota inválida no snapshot")
+            except Exception as e:
+                errors.put(f"{manager_cls.__name__}[{process}] leitura: {e!r}")
+
+        for n in range(USERS_PER_PROCESS):
+            manager.add_ratings_bulk(f"user{process}_{n}", expected_ratings(process, n))
+            threads = [threading.Thread(target=read) for _ in range(3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+    except Exception as e:
+        errors.put(f"{manager_cls.__name__}[{process}]: {e!r}")
+
+def check_contents(manager, label: str) -> list:
+    """Confere usuários, avaliações e contadores contra o que os processos gravaram"""
+    problems = []
+    for process in range(PROCESSES):
+        for n in range(USERS_PER_PROCESS):
+            username = f"user{process}_{n}"
+            if sorted(manager.get_user_ratings(username)) != sorted(expected_ratings(process, n)):
+                problems.append(f"{label}: avaliações de {username} não conferem")
+    total_users = PROCESSES * USERS_PER_PROCESS
+    columns = manager.get_ratings_columns()
+    if len(columns.rating) != total_users * RATINGS_PER_USER:
+        problems.append(f"{label}: snapshot colunar com {len(columns.rating)} linhas")
+    stats = manager.get_stats()
+    if stats['total_users'] != total_users or stats['total_ratings'] != total_users * RATINGS_PER_USER:
+        problems.append(f"{label}: contadores errados {stats}")
+    return problems
+
+def test_concurrent_writes():
+    """Escritas concorrentes, replay do journal e compactação em cada backend"""
+    failures = []
+    for manager_cls in (DataManager, SQLiteDataManager):
+        name = manager_cls.__name__
+        problems = []
+        with tempfile.TemporaryDirectory() as data_dir:
+            # Cria o esquema antes de iniciar os processos
+            manager_cls(data_dir)
+            errors = multiprocessing.Queue()
+            processes = [
+                multiprocessing.Process(target=writer, args=(manager_cls, data_dir, process, errors))
+                for process in range(PROCESSES)
+            ]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+                if process.exitcode != 0:
+                    problems.append(f"{name}: processo terminou com código {process.exitcode}")
+            while not errors.empty():
+                problems.append(errors.get())
+
+            # Um processo novo reconstrói tudo a partir do snapshot + journal
+            problems += check_contents(manager_cls(data_dir), f"{name} (replay)")
+            if manager_cls is DataManager:
+                manager = DataManager(data_dir)
+                manager.compact()
+                problems += check_contents(DataManager(data_dir), f"{name} (compactado)")
+
+        print(f"{'✅' if not problems else '❌'} {name}")
+        failures += problems
+    assert not failures, "\n".join(failures)
+
+def test_torn_journal_append():
+    """Linha parcial no journal (worker morto no meio do append) com outros workers ainda gravando"""
+    with tempfile.TemporaryDirectory() as data_dir:
+        # Duas instâncias fazem o papel de dois workers vivos
+        first, second = DataManager(data_dir), DataManager(data_dir)
+        first.add_user("alice")
+        with open(os.path.join(data_dir, "journal.log"), 'a') as f:
+            f.write('{"op": "rating", "user_id": 1, "mov')
+        second.add_user("bob")
+        first.add_user("carol")
+        second.add_ratings_bulk("bob", [("Filme 1", 4.0)])
+
+        problems = []
+        for label, manager in (("worker 1", first), ("worker 2", second), ("processo novo", DataManager(data_dir))):
+            ids = {username: manager.get_user_id(username) for username in ("alice", "bob", "carol")}
+            if None in ids.values() or len(set(ids.values())) != 3:
+                problems.append(f"{label}: usuários {ids}")
+            if manager.get_user_ratings("bob") != [("Filme 1", 4.0)] or manager.get_user_ratings("carol"):
+                problems.append(f"{label}: avaliações trocadas entre bob e carol")
+    print(f"{'✅' if not problems else '❌'} Journal com escrita interrompida")
+    assert not problems, "\n".join(problems)
+
+if __name__ == "__main__":
+    print(f"🧪 Testando {PROCESSES} processos gravando no mesmo data dir...")
+    try:
+        test_concurrent_writes()
+        test_torn_journal_append()
+    except AssertionError as e:
+        print(f"❌ Falhas:\n{e}")
+        sys.exit(1)
+    print("✅ Nenhuma escrita perdida e snapshots consistentes")